@@ -0,0 +1,276 @@
+##################################################################################
+# Description
+##################################################################################
+# This script renders the figures of the plotting scripts of this directory in
+# batch, over a product matrix of their parameters, e.g., of all control flows,
+# grids, landmasks and statistics, instead of one figure per run of a script.
+# Each plotting script is parsed and compiled once per worker process into a
+# template, where its global parameters in the matrix, e.g., STAT or TYPE, are
+# replaced by the values of each product, and settings of post_processing_config
+# in the matrix, e.g., CTR_FLW or LND_MSK, are set on the configuration module
+# while the product is rendered. All other settings are read from
+# post_processing_config.py as in a single run of the script.
+#
+# Products are rendered with the Agg backend by a pool of worker processes,
+# where the products of a script that read the same statistics, i.e., with the
+# same values of the parameters DATA_PARAMS, are rendered in sequence by one
+# worker, so that the statistics are read once through the cache of
+# gridstat_loader.py. Values of the matrix that are dictionaries set several
+# parameters together, e.g., a statistic with its line type.
+#
+##################################################################################
+# License Statement
+##################################################################################
+#
+# Copyright 2023 CW3E, Contact Colin Grudzien cgrudzien@ucsd.edu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+#
+##################################################################################
+# Imports
+##################################################################################
+import matplotlib
+# render without a display in all worker processes
+matplotlib.use('AGG')
+import matplotlib.pyplot as plt
+import ast
+import itertools
+import os
+import sys
+import time
+import multiprocessing
+from multiprocessing import Pool
+import post_processing_config as config
+from gridstat_paths import OUT_ROOT
+
+##################################################################################
+# SET GLOBAL PARAMETERS
+##################################################################################
+# product matrix of each plotting script, keyed by the names of settings of
+# post_processing_config or of global parameters of the script, where figures
+# are rendered for all combinations of the listed values
+BATCH = {
+         'plt_gridstat_multidate_heatplot.py': {
+             'CTR_FLW': ['NRT_gfs', 'NRT_ecmwf'],
+             'GRD': ['d01', 'd02'],
+             'LND_MSK': ['CA_All', 'San_Francisco_Bay'],
+             'STAT': ['RMSE', 'PR_CORR'],
+             },
+         'plt_gridstat_multidate_heatplot_level.py': {
+             'CTR_FLW': ['NRT_gfs', 'NRT_ecmwf'],
+             'GRD': ['d01', 'd02'],
+             'LND_MSK': ['CA_All', 'San_Francisco_Bay'],
+             'LEV': ['>=25.0', '>=50.0'],
+             'STAT': ['FSS', 'AFSS'],
+             },
+        }
+
+# parameters defining the statistics read for a figure, where products of a
+# script with the same values of these are rendered by the same worker
+DATA_PARAMS = [
+               'TYPE',
+               'CTR_FLW',
+               'CTR_FLWS',
+               'GRD',
+               'GRDS',
+               'PRFX',
+               'PRFXS',
+              ]
+
+# number of worker processes, set 0 to use all but one of the available cores
+N_PROCS = 0
+
+##################################################################################
+# Rendering routines
+##################################################################################
+# standard string indentation
+STR_INDT = '    '
+
+# directory of the plotting scripts
+SCRPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# compiled plotting scripts of this process, keyed by script and the names of
+# the global parameters that are replaced
+TMPLTS = {}
+
+# function to list the products of the matrix of a script, returns a list of
+# dictionaries of parameter values
+def get_products(matrix):
+    keys = list(matrix.keys())
+    prdcts = []
+    for vals in itertools.product(*[matrix[key] for key in keys]):
+        prdct = {}
+        for key, val in zip(keys, vals):
+            if isinstance(val, dict):
+                prdct.update(val)
+
+            else:
+                prdct[key] = val
+
+        prdcts.append(prdct)
+
+    return prdcts
+
+# function to label a product of a script for reporting
+def get_label(script, prdct):
+    return script + ' ' + ' '.join([key + '=' + str(val)
+                                    for key, val in prdct.items()])
+
+# function to compile a plotting script where the assignments of the global
+# parameters in params read the values of BATCH_PARAMS instead, raises a
+# ValueError if a parameter is not assigned in the script
+def get_template(script, params):
+    key = (script, tuple(sorted(params)))
+    if key not in TMPLTS.keys():
+        path = SCRPT_DIR + '/' + script
+        with open(path) as f:
+            tree = ast.parse(f.read(), filename=path)
+
+        found = []
+        for node in tree.body:
+            if isinstance(node, ast.Assign) and len(node.targets) == 1 and\
+                    isinstance(node.targets[0], ast.Name) and\
+                    node.targets[0].id in params:
+                node.value = ast.Subscript(
+                        value=ast.Name(id='BATCH_PARAMS', ctx=ast.Load()),
+                        slice=ast.Constant(value=node.targets[0].id),
+                        ctx=ast.Load())
+
+                found.append(node.targets[0].id)
+
+        missing = [param for param in params if param not in found]
+        if len(missing) > 0:
+            raise ValueError('parameters ' + ', '.join(missing) + ' are not' +\
+                    ' settings of post_processing_config or globals of ' + script)
+
+        TMPLTS[key] = compile(ast.fix_missing_locations(tree), path, 'exec')
+
+    return TMPLTS[key]
+
+# function to render one product of a script, where the settings of
+# post_processing_config are restored after rendering, returns the path of the
+# figure, or None if the figure was not rendered
+def render_product(script, prdct):
+    cnfg_params = {key: val for key, val in prdct.items() if hasattr(config, key)}
+    scrpt_params = {key: val for key, val in prdct.items()
+                    if key not in cnfg_params.keys()}
+
+    dflts = {key: getattr(config, key) for key in cnfg_params.keys()}
+    try:
+        code = get_template(script, list(scrpt_params.keys()))
+        for key, val in cnfg_params.items():
+            setattr(config, key, val)
+
+        os.makedirs(OUT_ROOT + '/figures' + config.FIG_CSE, exist_ok=True)
+        glbls = {'__name__': script[:-3], '__file__': SCRPT_DIR + '/' + script,
+                 'BATCH_PARAMS': scrpt_params}
+
+        exec(code, glbls)
+
+        return glbls['OUT_PATH']
+
+    except SystemExit:
+        print('WARNING: ' + get_label(script, prdct) + ' exited on a' +\
+                ' configuration error, skipping this product.')
+
+        return None
+
+    except Exception as err:
+        print('WARNING: ' + get_label(script, prdct) + ' failed with ' +\
+                type(err).__name__ + ': ' + str(err) + ', skipping this product.')
+
+        return None
+
+    finally:
+        for key, val in dflts.items():
+            setattr(config, key, val)
+
+        plt.close('all')
+
+# function to render the products of a script sharing statistics in sequence,
+# where task is the script and its products, returns a list of the labels, wall
+# times, success and process id of the products
+def render_batch(task):
+    script, prdcts = task
+    prdct_times = []
+    for prdct in prdcts:
+        strt = time.perf_counter()
+        rendered = render_product(script, prdct) is not None
+        prdct_times.append([get_label(script, prdct),
+                            time.perf_counter() - strt, rendered, os.getpid()])
+
+    return prdct_times
+
+# function to group the products of all scripts into batches of products that
+# read the same statistics, returns batches in decreasing order of size
+def get_batches(batch):
+    batches = {}
+    for script, matrix in batch.items():
+        for prdct in get_products(matrix):
+            key = (script,) + tuple(str(prdct.get(param))
+                                    for param in DATA_PARAMS)
+
+            if key not in batches.keys():
+                batches[key] = [script, []]
+
+            batches[key][1].append(prdct)
+
+    return sorted(batches.values(), key=lambda x: len(x[1]), reverse=True)
+
+##################################################################################
+# Runs multiprocessing on the product matrix
+##################################################################################
+# run lines if executed as a script
+if __name__ == '__main__':
+    batches = get_batches(BATCH)
+    num_prdcts = sum([len(prdcts) for script, prdcts in batches])
+
+    n_procs = N_PROCS
+    if n_procs == 0:
+        n_procs = max(multiprocessing.cpu_count() - 1, 1)
+
+    n_procs = min(n_procs, max(len(batches), 1))
+    print('Rendering ' + str(num_prdcts) + ' products in ' + str(len(batches)) +\
+            ' batches with ' + str(n_procs) + ' total workers.')
+
+    strt = time.perf_counter()
+    prdct_times = []
+    if n_procs > 1:
+        with Pool(n_procs) as pool:
+            for btch_times in pool.imap_unordered(render_batch, batches):
+                prdct_times += btch_times
+
+    else:
+        for btch in batches:
+            prdct_times += render_batch(btch)
+
+    wall_time = time.perf_counter() - strt
+
+    # report products that were not rendered and the total wall time
+    failed = [label for label, prdct_time, rendered, pid in prdct_times
+              if not rendered]
+
+    if len(failed) > 0:
+        print('Products not rendered:')
+        for label in failed:
+            print(STR_INDT + label)
+
+    print('Rendered ' + str(num_prdcts - len(failed)) + ' of ' +\
+            str(num_prdcts) + ' products in ' + '%.2f'%wall_time + 's, ' +\
+            '%.2f'%(wall_time / max(num_prdcts, 1)) + 's per product.')
+
+    if len(failed) > 0:
+        sys.exit(1)
+
+##################################################################################
+# end
@@ -0,0 +1,237 @@
+##################################################################################
+# Description
+##################################################################################
+# This script benchmarks the startup cost of the entry points of this directory,
+# i.e., the scripts that are run directly, as the time to run the imports of
+# each script measured by python -X importtime. The import section of each
+# script, its leading imports including the imports of a configured source of
+# statistics and the selection of the matplotlib backend, is run in a new
+# interpreter N_RPTS times, and the fastest run is reported with the modules
+# imported by the script that take the most time. Modules imported by the
+# interpreter at startup are not counted.
+#
+# The times of each run of the benchmark are appended to the history at LOG_F,
+# and compared to the median time of the last N_HIST runs, where the script
+# exits with an error if the import time of an entry point has grown by more
+# than REG_TOL of the median and by at least REG_MIN milliseconds, e.g., when a
+# heavy dependency is imported at the top of a plotting script. The thresholds
+# are above the variation of import times between runs on a busy node. Entry
+# points are benchmarked one at a time, as concurrent runs would slow each
+# other.
+#
+##################################################################################
+# License Statement
+##################################################################################
+#
+# Copyright 2023 CW3E, Contact Colin Grudzien cgrudzien@ucsd.edu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+#
+##################################################################################
+# Imports
+##################################################################################
+import ast
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime as dt
+from statistics import median
+from gridstat_paths import OUT_ROOT
+
+##################################################################################
+# SET GLOBAL PARAMETERS
+##################################################################################
+# scripts of this directory that are run directly
+ENTRY_PNTS = [
+              'proc_gridstat.py',
+              'concat_gridstat_df.py',
+              'gridstat_index.py',
+              'gridstat_db.py',
+              'gridstat_cube.py',
+              'gridstat_agg.py',
+              'plt_gridstat_multidate_heatplot.py',
+              'plt_gridstat_multidate_heatplot_level.py',
+              'plt_gridstat_multilead_lineplot.py',
+              'plt_gridstat_multilead_lineplot_level.py',
+              'batch_plot_gridstat.py',
+              'serve_plot_gridstat.py',
+             ]
+
+# number of runs of the imports of each entry point, the fastest is reported
+N_RPTS = 5
+
+# number of the slowest modules imported by an entry point that are reported
+N_TOP = 4
+
+# history of the import times of the entry points
+LOG_F = OUT_ROOT + '/batch_logs/import_times.json'
+
+# number of the previous runs in the history that times are compared to
+N_HIST = 5
+
+# growth of an import time over the median of the previous runs reported as a
+# regression, as a fraction of the median and in milliseconds, both must be
+# exceeded
+REG_TOL = 0.5
+REG_MIN = 150
+
+##################################################################################
+# Benchmark routines
+##################################################################################
+# standard string indentation
+STR_INDT = '    '
+
+# directory of the entry points
+SCRPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# function to check if a top level statement of a script belongs to its import
+# section, i.e., is an import, a conditional block of imports or the selection
+# of the matplotlib backend
+def is_import(node):
+    if isinstance(node, (ast.Import, ast.ImportFrom)):
+        return True
+
+    elif isinstance(node, ast.If):
+        return all(is_import(child) for child in node.body + node.orelse)
+
+    elif isinstance(node, ast.Expr) and isinstance(node.value, ast.Call):
+        return ast.unparse(node.value.func) == 'matplotlib.use'
+
+    return False
+
+# function to extract the import section of a script, the leading statements
+# that are imports, returns the source of the section
+def get_imports(script):
+    with open(SCRPT_DIR + '/' + script) as f:
+        tree = ast.parse(f.read())
+
+    nodes = []
+    for node in tree.body:
+        if not is_import(node):
+            break
+
+        nodes.append(node)
+
+    return ast.unparse(ast.Module(body=nodes, type_ignores=[]))
+
+# function to run source in a new interpreter with -X importtime, returns a
+# list of the names and cumulative times in milliseconds of the modules imported
+# at the top level
+def run_importtime(src):
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', src],
+                          cwd=SCRPT_DIR, capture_output=True, text=True)
+
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().split('\n')[-1])
+
+    mods = []
+    for line in proc.stderr.split('\n'):
+        if not line.startswith('import time:'):
+            continue
+
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+
+        # modules imported at the top level are not indented
+        name = fields[2][1:]
+        if name == name.lstrip():
+            mods.append([name, int(fields[1]) / 1000])
+
+    return mods
+
+# function to benchmark the imports of an entry point, where the modules in
+# startup are imported by the interpreter before any script, returns the total
+# import time in milliseconds and the slowest modules of the fastest run
+def bench_entry(script, startup):
+    src = get_imports(script)
+    best = None
+    for i_nr in range(N_RPTS):
+        mods = [mod for mod in run_importtime(src) if mod[0] not in startup]
+        total = sum([mod_time for name, mod_time in mods])
+        if best is None or total < best[0]:
+            best = [total, sorted(mods, key=lambda x: x[1], reverse=True)[:N_TOP]]
+
+    return best
+
+##################################################################################
+# Runs the benchmark on all entry points
+##################################################################################
+# run lines if executed as a script
+if __name__ == '__main__':
+    startup = set([name for name, mod_time in run_importtime('pass')])
+
+    # load the history of the previous runs
+    hist = []
+    if os.path.isfile(LOG_F):
+        try:
+            with open(LOG_F) as f:
+                hist = json.load(f)
+
+        except (OSError, ValueError):
+            print('WARNING: history ' + LOG_F + ' is not readable, starting' +\
+                    ' a new history.')
+
+    # median times of the entry points over the last runs
+    prev = {}
+    for script in ENTRY_PNTS:
+        prev_times = [run['times'][script]['total'] for run in hist[-N_HIST:]
+                      if script in run['times'].keys()]
+
+        if len(prev_times) > 0:
+            prev[script] = median(prev_times)
+
+    times = {}
+    regs = []
+    for script in ENTRY_PNTS:
+        try:
+            total, top = bench_entry(script, startup)
+
+        except Exception as err:
+            print('WARNING: imports of ' + script + ' failed with ' +\
+                    type(err).__name__ + ': ' + str(err) + ', skipping this' +\
+                    ' entry point.')
+            continue
+
+        times[script] = {'total': round(total, 1), 'top': top}
+        line = script + ': ' + '%.1f'%total + 'ms'
+        if script in prev.keys():
+            diff = total - prev[script]
+            line += ' (' + '%+.1f'%diff + 'ms from the median)'
+            if diff > REG_MIN and diff > REG_TOL * prev[script]:
+                regs.append(script)
+
+        print(line)
+        for name, mod_time in top:
+            print(STR_INDT + name + ': ' + '%.1f'%mod_time + 'ms')
+
+    hist.append({'date': dt.now().isoformat(timespec='seconds'),
+                 'python': sys.version.split()[0], 'times': times})
+
+    os.makedirs(os.path.dirname(LOG_F), exist_ok=True)
+    with open(LOG_F + '.tmp', 'w') as f:
+        json.dump(hist, f, indent=1)
+
+    os.replace(LOG_F + '.tmp', LOG_F)
+
+    if len(regs) > 0:
+        print('Import times have grown over the median of the last ' +\
+                str(min(len(hist) - 1, N_HIST)) + ' runs:')
+        for script in regs:
+            print(STR_INDT + script)
+
+        sys.exit(1)
+
+##################################################################################
+# end
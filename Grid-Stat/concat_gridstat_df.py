@@ -1,7 +1,7 @@
 ##################################################################################
 # Description
 ##################################################################################
-# This script reads in arbitrary grid_stats_*.bin output files from
+# This script reads in arbitrary grid_stats_* statistics stores from
 # proc_gridstat.py and concatenates Pandas dataframes of pecified statistics
 # types writing workflow parameters as labels for later statistical encoding.
 # The dataframes are saved into a dictionary with key names associated
@@ -34,11 +34,15 @@ import numpy as np
 import pandas as pd
 from pandas.api.types import CategoricalDtype
 import pickle
-import copy
-import glob
+import json
+import multiprocessing
+from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
+from met_line_types import concat_typed
+from gridstat_store import read_columns, read_stats
+from gridstat_index import load_index, index_glob
 #import statsmodels.api as sm
 #from statsmodels.formula.api import ols
-import ipdb
 
 ##################################################################################
 # SET GLOBAL PARAMETERS 
@@ -103,14 +107,31 @@ IN_ROOT = '/cw3e/mead/projects/cwp106/scratch/cgrudzien/tuning_regression_analys
 # root directory for processed pandas outputs
 OUT_ROOT = '/cw3e/mead/projects/cwp106/scratch/cgrudzien/tuning_regression_analysis'
 
+# optionally define a fixed output name, e.g., for one consolidated output that
+# is updated as case studies and control flows are added, set as empty string to
+# name outputs by the case studies, control flows, grids and prefixes
+OUT_NAME = ''
+
+# update an existing output in place, where only the case study / control flow /
+# grid / prefix partitions with new or changed stores are read and replaced, and
+# partitions of the existing output that are not in the above lists are kept
+UPSRT = False
+
 ##################################################################################
 # Data processing routines
 ##################################################################################
 # standard string indentation
 STR_INDT = '    '
 
+# number of threads reading the statistics stores of a partition concurrently,
+# where column reads are file I/O that release the interpreter lock
+N_THRDS = 8
+
+# number of worker processes concatenating case study / control flow / grid /
+# prefix partitions concurrently, set 0 to use all but one of the available cores
+N_PROCS = 0
+
 log_dir = OUT_ROOT + '/batch_logs'
-os.system('mkdir -p ' + log_dir)
 
 # generate output file names from the analyzed case studies and control flows
 out_name = 'concat_df'
@@ -136,140 +157,309 @@ for prfx in PRFXS:
     else:
         pfx = ''
     out_name += prfx
+
+if len(OUT_NAME) > 0:
+    out_name = OUT_NAME
                      
 log_f = log_dir + '/' + out_name + '.log'
 out_path = OUT_ROOT + '/' + out_name + '.bin'
 
-# creating empty dictionary for storage of merged dataframes
-data_dict = {}
-
-with open(log_f, 'w') as log_f:
-    for cse in CSES:
-        for ctr_flw in CTR_FLWS:
-            for grid in GRDS:
-                # include underscore if grid is of nonzero length
-                if len(grid) > 0:
-                    grd = '_' + grid
-                else:
-                    grd = ''
-                    
-                for prfx in PRFXS:
-                    # include underscore if prefix is of nonzero length
-                    if len(prfx) > 0:
-                        pfx = '_' + prfx
-                    else:
-                        pfx = ''
-                    
-                    # check for input / output root directory
-                    if not os.path.isdir(IN_ROOT):
-                        print('ERROR: input data root directory ' + IN_ROOT +\
-                                ' does not exist.', file=log_f)
-                        sys.exit(1)
-                    
-                    # check for input / output root directory
-                    elif not os.path.isdir(OUT_ROOT):
-                        print('ERROR: output data root directory ' +\
-                                OUT_ROOT + ' does not exist.', file=log_f)
-                        sys.exit(1)
-                   
-                    # define the gridstat files to open based on the analysis date
-                    in_paths = IN_ROOT + '/' + cse + '/' + ctr_flw + '/*' +\
-                               '/grid_stat' + pfx + grd + '*.bin'
-
-                    # loop sorted grid_stat_*.bin files
-                    print('Searching in_paths for pickled data frames:', file=log_f)
-                    print(STR_INDT + in_paths, file=log_f)
-                    in_paths = sorted(glob.glob(in_paths))
-                               
-                    print('Processing date binaries at paths:', file=log_f)
-                    for in_path in in_paths:
-                        print(STR_INDT + in_path, file=log_f)
-
-                    # dataframe corresponding to case / control flow / grid / prefix
-                    param_df = {'CASE': [cse], 'CTR_FLW': [ctr_flw],
-                                'GRID': [grid],  'PRFX': [prfx]}
-
-                    param_df = pd.DataFrame.from_dict(param_df, orient='columns')
-
-                    for in_path in in_paths:
-                        try:
-                            with open(in_path, 'rb') as f:
-                                date_data = pickle.load(f)
-    
-                            for stat_type in TYPES:
-                                # storage for merged dataframes of same stat type
-                                merge_df = pd.DataFrame()
-
-                                try:
-                                    # extract parsed fields of stat_type
-                                    stat_df = date_data[stat_type]
-                                    
-                                    # extract basic fields for output data
-                                    field_df = stat_df[FLDS]
-
-                                    for stat in STATS:
-                                        try:
-                                            # assign additional columns for specific statistics
-                                            exec('field_df = field_df.assign(%s=stat_df[\'%s\'])'%(stat,stat))
-    
-                                        except:
-                                            print('WARNING: ' + stat + ' not found in value pair of:', file=log_f)
-                                            print(STR_INDT + 'File: '  + in_path, file=log_f)
-                                            print(STR_INDT + 'Key: ' + stat_type, file=log_f)
-    
-                                    # merge worfklow parameters into columns
-                                    tmp_df = param_df.merge(field_df, how='cross') 
-    
-                                    if stat_type in data_dict.keys():
-                                        data_dict[stat_type] = pd.concat([data_dict[stat_type], tmp_df], axis=0)
-    
-                                    else:
-                                        data_dict[stat_type] = tmp_df
-    
-                                except:
-                                    print('WARNING: ' + stat_type + ' key not found in:',
-                                            file=log_f)
-                                    print(STR_INDT + in_path, file=log_f)
-                                            
-                        except:
-                            print('WARNING: file:\n' + in_path, file=log_f)
-                            print('is not readable, skipping this file.')
-   
-    for dict_key in data_dict.keys():
-        # clean up concatenated dataframes
-        tmp_df = data_dict[dict_key]
-
-        # turn forecast thresholds into ordered categories
-        tmp_df['FCST_THRESH'] = pd.Categorical(tmp_df['FCST_THRESH'].values,
-                categories=LEVS, ordered=True)
-
-        # sort data on the following order
-        sort_order = ['CASE', 'CTR_FLW', 'GRID', 'PRFX'] + FLDS
-        tmp_df = tmp_df.sort_values(by=sort_order)
-
-        # clean NAs including non-matching categories
-        tmp_df = tmp_df.dropna(axis=1, how='all')
-        
-        # drop columns of empty strings
-        for df_key in tmp_df.keys():
-            if (tmp_df[df_key].values == '').all():
-                tmp_df = tmp_df.drop(labels = [df_key], axis = 1)
+# record of the stores concatenated in each partition of the output
+parts_path = OUT_ROOT + '/' + out_name + '.json'
+
+# categories of the workflow parameters tagged on the statistics, in sorted
+# order so that categorical sorting agrees with sorting the parameter strings
+PARAM_CATS = {
+              'CASE': sorted(set(CSES)),
+              'CTR_FLW': sorted(set(CTR_FLWS)),
+              'GRID': sorted(set(GRDS)),
+              'PRFX': sorted(set(PRFXS)),
+             }
+
+# function to load the verification fields and available statistics of each
+# stat type from one store, tagged with the workflow parameters as categorical
+# columns, returns a dictionary of dataframes by stat type and log messages
+def load_store(task):
+    cse, ctr_flw, grid, prfx, in_path = task
+    params = {'CASE': cse, 'CTR_FLW': ctr_flw, 'GRID': grid, 'PRFX': prfx}
+    stat_dfs = {}
+    msgs = []
+    for stat_type in TYPES:
+        try:
+            # project the parsed fields and available stats of stat_type
+            cols = read_columns(in_path, stat_type)
+            stats = [stat for stat in STATS if stat in cols]
+            stat_df = read_stats(in_path, stat_type, columns=FLDS + stats)
+
+        except:
+            msgs += ['WARNING: ' + stat_type + ' key not found in:',
+                     STR_INDT + in_path]
+            continue
 
         for stat in STATS:
-            # convert statistics to float values
-            try:
-                tmp_df[stat] = tmp_df[stat].astype('float')
+            if stat not in stats:
+                msgs += ['WARNING: ' + stat + ' not found in value pair of:',
+                         STR_INDT + 'File: ' + in_path,
+                         STR_INDT + 'Key: ' + stat_type]
+
+        # constant parameter columns as codes into the shared categories
+        n_rows = len(stat_df.index)
+        param_df = {}
+        for key, val in params.items():
+            param_df[key] = pd.Categorical.from_codes(
+                    np.full(n_rows, PARAM_CATS[key].index(val), dtype='int32'),
+                    categories=PARAM_CATS[key])
+
+        param_df = pd.DataFrame(param_df, index=stat_df.index)
+        stat_dfs[stat_type] = pd.concat([param_df, stat_df], axis=1)
+
+    return stat_dfs, msgs
+
+# function to label the partition of a case study / control flow / grid / prefix
+def get_part_key(cse, ctr_flw, grid, prfx):
+    return '/'.join([cse, ctr_flw, grid, prfx])
+
+# function to load and concatenate the stores of one partition, where part_tasks
+# are the load_store tasks of the partition in sorted order, returns a dictionary
+# of dataframes by stat type and log messages
+def load_part(part_tasks):
+    with ThreadPoolExecutor(max_workers=N_THRDS) as pool:
+        results = list(pool.map(load_store, part_tasks))
+
+    stat_dfs = {}
+    msgs = []
+    for res in results:
+        msgs += res[1]
+
+    for stat_type in TYPES:
+        type_dfs = [res[0][stat_type] for res in results
+                    if stat_type in res[0].keys()]
+
+        if len(type_dfs) > 0:
+            stat_dfs[stat_type] = concat_typed(type_dfs, axis=0,
+                                               ignore_index=True)
+
+    return stat_dfs, msgs
+
+# function to restore the workflow parameter columns of empty strings, which are
+# dropped from outputs in the clean up below
+def restore_params(stat_df):
+    n_rows = len(stat_df.index)
+    for key in PARAM_CATS.keys():
+        if key not in stat_df.columns:
+            stat_df[key] = pd.Categorical.from_codes(
+                    np.zeros(n_rows, dtype='int32'), categories=[''])
+
+    return stat_df
+
+# function to find the rows of a dataframe in any of the partitions part_keys
+def in_parts(stat_df, part_keys):
+    row_keys = stat_df['CASE'].astype(str)
+    for key in ['CTR_FLW', 'GRID', 'PRFX']:
+        row_keys = row_keys + '/' + stat_df[key].astype(str)
+
+    return row_keys.isin(part_keys).values
+
+# function to load an existing output and the stores of its partitions, returns
+# empty dictionaries if either is missing or unreadable
+def load_output(out_path, parts_path):
+    try:
+        with open(out_path, 'rb') as f:
+            data_dict = pickle.load(f)
+
+        with open(parts_path) as f:
+            parts = json.load(f)
+
+    except (OSError, ValueError, pickle.UnpicklingError):
+        return {}, {}
+
+    return data_dict, parts
+
+##################################################################################
+# Concatenates the statistics of all partitions
+##################################################################################
+# run lines if executed as a script
+if __name__ == '__main__':
+    os.makedirs(log_dir, exist_ok=True)
+
+    # list the stores of each case / control flow / grid / prefix in sorted order
+    tasks = []
+
+    # index the statistics stores below IN_ROOT in one scan
+    index = load_index(IN_ROOT)
+
+    with open(log_f, 'w') as log_f:
+        # check for input / output root directory
+        if not os.path.isdir(IN_ROOT):
+            print('ERROR: input data root directory ' + IN_ROOT +\
+                    ' does not exist.', file=log_f)
+            sys.exit(1)
+
+        # check for input / output root directory
+        elif not os.path.isdir(OUT_ROOT):
+            print('ERROR: output data root directory ' +\
+                    OUT_ROOT + ' does not exist.', file=log_f)
+            sys.exit(1)
+
+        for cse in CSES:
+            for ctr_flw in CTR_FLWS:
+                for grid in GRDS:
+                    # include underscore if grid is of nonzero length
+                    if len(grid) > 0:
+                        grd = '_' + grid
+                    else:
+                        grd = ''
+
+                    for prfx in PRFXS:
+                        # include underscore if prefix is of nonzero length
+                        if len(prfx) > 0:
+                            pfx = '_' + prfx
+                        else:
+                            pfx = ''
+
+                        # define the gridstat stores to open based on the analysis date
+                        in_paths = IN_ROOT + '/' + cse + '/' + ctr_flw + '/*' +\
+                                   '/grid_stats' + pfx + grd + '_*/'
+
+                        # loop sorted grid_stats_* store directories
+                        print('Searching in_paths for statistics stores:', file=log_f)
+                        print(STR_INDT + in_paths, file=log_f)
+                        in_paths = sorted([in_path[:-1] for in_path in
+                                           index_glob(index, in_paths)])
+
+                        print('Processing date binaries at paths:', file=log_f)
+                        for in_path in in_paths:
+                            print(STR_INDT + in_path, file=log_f)
+                            tasks.append([cse, ctr_flw, grid, prfx, in_path])
+
+        # stores of each partition with their modification times in ns, which
+        # change when a store is re-processed and moved into place
+        parts = {}
+        for cse, ctr_flw, grid, prfx, in_path in tasks:
+            part_key = get_part_key(cse, ctr_flw, grid, prfx)
+            if part_key not in parts.keys():
+                parts[part_key] = {}
+
+            parts[part_key][in_path] = os.stat(in_path).st_mtime_ns
+
+        # storage for the rows of an existing output that are kept
+        data_dict = {}
+        if UPSRT:
+            data_dict, old_parts = load_output(out_path, parts_path)
+            if len(data_dict) == 0:
+                print('WARNING: no existing output ' + out_path + ' with ' +\
+                        'partitions ' + parts_path + ', processing all partitions.',
+                        file=log_f)
+
+            else:
+                # read only new partitions or partitions with changed stores
+                updt_keys = [part_key for part_key in parts.keys()
+                             if old_parts.get(part_key) != parts[part_key]]
+
+                if len(updt_keys) == 0:
+                    print('Output ' + out_path + ' is up to date.', file=log_f)
+                    sys.exit(0)
+
+                print('Updating partitions:', file=log_f)
+                for part_key in updt_keys:
+                    print(STR_INDT + part_key, file=log_f)
+
+                tasks = [task for task in tasks
+                         if get_part_key(*task[:4]) in updt_keys]
+
+                # drop the rows of updated partitions from the existing output
+                for stat_type in data_dict.keys():
+                    stat_df = restore_params(data_dict[stat_type])
+                    data_dict[stat_type] = stat_df[~in_parts(stat_df, updt_keys)]
+
+                parts = {**old_parts, **parts}
+
+        # group the store tasks by partition, in sorted order of the partitions
+        part_tasks = {}
+        for task in tasks:
+            part_tasks.setdefault(tuple(task[:4]), []).append(task)
+
+        part_tasks = [part_tasks[part] for part in sorted(part_tasks.keys())]
+
+        n_procs = N_PROCS
+        if n_procs == 0:
+            n_procs = max(multiprocessing.cpu_count() - 1, 1)
+
+        # load the partitions concurrently, where results are returned in the sorted
+        # order of the partitions independently of the order of completion
+        n_procs = min(n_procs, len(part_tasks))
+        if n_procs > 1:
+            with Pool(n_procs) as pool:
+                results = pool.map(load_part, part_tasks)
+
+        else:
+            results = [load_part(task) for task in part_tasks]
+
+        # concatenate each stat type once over all partitions
+        for stat_dfs, msgs in results:
+            for msg in msgs:
+                print(msg, file=log_f)
+
+        for stat_type in TYPES:
+            stat_dfs = [res[0][stat_type] for res in results
+                        if stat_type in res[0].keys()]
+
+            if stat_type in data_dict.keys():
+                stat_dfs = [data_dict[stat_type]] + stat_dfs
+
+            if len(stat_dfs) > 0:
+                data_dict[stat_type] = concat_typed(stat_dfs, axis=0,
+                                                    ignore_index=True)
+
+        for dict_key in data_dict.keys():
+            # clean up concatenated dataframes
+            tmp_df = data_dict[dict_key]
+
+            # turn forecast thresholds into ordered categories
+            tmp_df['FCST_THRESH'] = pd.Categorical(tmp_df['FCST_THRESH'].values,
+                    categories=LEVS, ordered=True)
+
+            # sort categories of the workflow parameters and the verification
+            # fields, which are unions in order of appearance over the stores, so
+            # that rows are sorted on the values of the strings
+            sort_order = ['CASE', 'CTR_FLW', 'GRID', 'PRFX'] + FLDS
+            for key in sort_order:
+                if key in tmp_df.columns and key != 'FCST_THRESH' and\
+                        isinstance(tmp_df[key].dtype, CategoricalDtype):
+                    tmp_df[key] = tmp_df[key].cat.set_categories(
+                            sorted(tmp_df[key].cat.categories))
+
+            # sort data on the following order, where the sort is stable so that
+            # ties keep the sorted order of the partitions and stores
+            tmp_df = tmp_df.sort_values(by=sort_order, kind='stable')
+
+            # clean NAs including non-matching categories
+            tmp_df = tmp_df.dropna(axis=1, how='all')
+
+            # drop columns of empty strings
+            for df_key in tmp_df.keys():
+                if (tmp_df[df_key].values == '').all():
+                    tmp_df = tmp_df.drop(labels = [df_key], axis = 1)
+
+            for stat in STATS:
+                # convert statistics to float values
+                try:
+                    tmp_df[stat] = tmp_df[stat].astype('float')
+
+                except:
+                    pass
 
-            except:
-                pass
+            # re-index based on row values
+            tmp_df = tmp_df.set_axis(range(1, len(tmp_df.index) +1 ), axis='index')
 
-        # re-index based on row values
-        tmp_df = tmp_df.set_axis(range(1, len(tmp_df.index) +1 ), axis='index')
+            # store back in the dictionry under dict_key
+            data_dict[dict_key] = tmp_df
 
-        # store back in the dictionry under dict_key
-        data_dict[dict_key] = tmp_df
+        print('Writing out data to ' + out_path, file=log_f)
+        with open(out_path + '.tmp', 'wb') as f:
+            pickle.dump(data_dict, f)
 
-    print('Writing out data to ' + out_path, file=log_f)
-    with open(out_path, 'wb') as f:
-        pickle.dump(data_dict, f)
+        os.replace(out_path + '.tmp', out_path)
 
+        with open(parts_path, 'w') as f:
+            json.dump(parts, f, indent=1, sort_keys=True)
@@ -0,0 +1,436 @@
+##################################################################################
+# Description
+##################################################################################
+# This module aggregates Grid-Stat statistics exactly over arbitrary groupings of
+# the processed statistics stores, e.g., over all cycles of a period by control
+# flow, verification region, lead and month, without re-running MET
+# stat_analysis. Aggregate scores are computed from the partial sums of the
+# following line types, pooled over the lines of each group:
+#
+#     sl1l2         - scalar partial sums, weighted by TOTAL, for FBAR, OBAR,
+#                     ME, MAE, MSE, RMSE, BCMSE, ESTDEV, FSTDEV, OSTDEV, MBIAS
+#                     and PR_CORR
+#     ctc / nbrctc  - contingency table counts, summed, for BASER, FMEAN, ACC,
+#                     FBIAS, PODY, PODN, POFD, FAR, CSI, GSS, HK and HSS
+#     nbrcnt        - fractions Brier score terms, weighted by TOTAL, for FBS,
+#                     FSS, AFSS, UFSS, F_RATE and O_RATE
+#
+# The SL1L2 output of Grid-Stat is enabled in the output_flag block of the
+# GridStatConfigTemplate, and all of the above line types are ingested by
+# proc_gridstat.py. Groups are defined by any columns of the stores and by the
+# key columns CTR_FLW, GRD, PRFX and CYCLE of each store, and the column MONTH,
+# the valid year and month in YYYYMM format. Lines with missing partial sums
+# are excluded from the aggregates of their groups, except NBRCNT lines with an
+# FSS of 1 or NA, which define no FSS reference and are only left out of the
+# sums of the aggregate FSS.
+#
+# Confidence intervals of the aggregate scores are estimated by bootstrap
+# resampling of the cycles, or of any other column, e.g., case studies, in place
+# of bootstrap resampling within Grid-Stat (BTSTRP = 0 in pre_processing_config.sh).
+# The partial sums of each group are first summed by resampled unit, and the
+# partial sums of all replicates are then products of a matrix of the number of
+# times each unit is drawn in each replicate with these unit sums. Percentile
+# intervals are written as the columns STAT_BCL and STAT_BCU, as in MET outputs,
+# where groups are distributed over a pool of worker processes.
+#
+##################################################################################
+# License Statement
+##################################################################################
+#
+# Copyright 2023 CW3E, Contact Colin Grudzien cgrudzien@ucsd.edu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+#
+##################################################################################
+# Imports
+##################################################################################
+import os
+import pickle
+import multiprocessing
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from met_line_types import concat_typed
+from gridstat_store import read_columns, read_stats, read_manifest
+from gridstat_index import load_index, list_stores
+from gridstat_db import get_store_keys
+
+##################################################################################
+# SET GLOBAL PARAMETERS
+##################################################################################
+# partial sum columns of the line types that can be aggregated
+SUM_COLS = {
+            'sl1l2': ['TOTAL', 'FBAR', 'OBAR', 'FOBAR', 'FFBAR', 'OOBAR', 'MAE'],
+            'ctc': ['TOTAL', 'FY_OY', 'FY_ON', 'FN_OY', 'FN_ON'],
+            'nbrctc': ['TOTAL', 'FY_OY', 'FY_ON', 'FN_OY', 'FN_ON'],
+            'nbrcnt': ['TOTAL', 'FBS', 'FSS', 'F_RATE', 'O_RATE'],
+           }
+
+# columns of the stores loaded with the partial sums for grouping
+GRP_COLS = ['FCST_VAR', 'VX_MASK', 'INTERP_PNTS', 'FCST_THRESH', 'LEAD_HR',
+            'VALID_DT', 'INIT_DT']
+
+# key columns of each store
+KEY_COLS = ['CTR_FLW', 'GRD', 'PRFX', 'CYCLE']
+
+# line type of the partial sums aggregated when run as a script
+AGG_TYPE = 'sl1l2'
+
+# default grouping of the aggregates
+AGG_BY = ['CTR_FLW', 'GRD', 'VX_MASK', 'FCST_THRESH', 'LEAD_HR']
+
+# column of the units resampled in bootstrap replicates
+RSMPL = 'CYCLE'
+
+# number of bootstrap replicates, set 0 to aggregate without intervals
+N_BOOT = 1000
+
+# significance level of the bootstrap confidence intervals
+BOOT_ALPHA = 0.05
+
+# number of groups per task of the worker pool, bounding the memory of the
+# replicate sums of each task
+BOOT_CHNK = 256
+
+# scores that are counts, without confidence intervals
+CNT_STATS = ['TOTAL', 'FY_OY', 'FY_ON', 'FN_OY', 'FN_ON']
+
+##################################################################################
+# Loading partial sums
+##################################################################################
+# function to load the partial sums of a line type from the stores below root,
+# optionally only from stores with the listed control flows, grids, prefixes and
+# cycles, and rows matching filters as in read_stats, returns a dataframe with
+# the key columns of each store, the grouping columns, MONTH and partial sums
+def load_sums(root, line_type, ctr_flws=None, grds=None, prfxs=None,
+              cycles=None, filters=None):
+    if line_type not in SUM_COLS.keys():
+        raise ValueError(line_type + ' is not a line type of partial sums, ' +\
+                'one of ' + str(list(SUM_COLS.keys())))
+
+    key_fltrs = [ctr_flws, grds, prfxs, cycles]
+    index = load_index(root.rstrip('/'))
+    sum_dfs = []
+    for rec in sorted(list_stores(index), key=lambda rec: rec['path']):
+        store_path = rec['path']
+        if rec['name'].endswith('.bin') or\
+                not os.path.isdir(store_path + '/' + line_type):
+            continue
+
+        keys = get_store_keys(store_path, read_manifest(store_path))
+        if not all(fltr is None or key in fltr for key, fltr in
+                   zip(keys, key_fltrs)):
+            continue
+
+        try:
+            cols = read_columns(store_path, line_type)
+            sum_df = read_stats(store_path, line_type,
+                                columns=[col for col in GRP_COLS if col in cols] +\
+                                        SUM_COLS[line_type], filters=filters)
+
+        except Exception as err:
+            print('WARNING: store ' + store_path + ' statistics ' + line_type +\
+                    ' could not be loaded, skipping this store: ' + str(err))
+            continue
+
+        sum_df = sum_df.reset_index(drop=True)
+        for key, val in zip(KEY_COLS, keys):
+            sum_df[key] = pd.Categorical.from_codes(
+                    np.zeros(len(sum_df.index), dtype='int32'), categories=[val])
+
+        sum_dfs.append(sum_df)
+
+    if len(sum_dfs) == 0:
+        return pd.DataFrame(columns=KEY_COLS + GRP_COLS + ['MONTH'] +\
+                SUM_COLS[line_type])
+
+    sums = concat_typed(sum_dfs, axis=0, ignore_index=True)
+    sums['MONTH'] = sums['VALID_DT'].dt.strftime('%Y%m').astype('category')
+
+    return sums
+
+##################################################################################
+# Group-by reductions
+##################################################################################
+# function to find the groups of the rows of a dataframe by the columns in by,
+# returns the group of each row and a dataframe of the group labels, sorted
+def get_groups(df, by):
+    if len(by) == 0:
+        return np.zeros(len(df.index), dtype=int), pd.DataFrame(index=[0])
+
+    codes = []
+    labels = []
+    for col in by:
+        col_codes, col_labels = pd.factorize(df[col], sort=True)
+        codes.append(col_codes)
+        labels.append(col_labels)
+
+    grp_codes, grps = np.unique(np.stack(codes, axis=1), axis=0,
+                                return_inverse=True)
+
+    grp_df = {}
+    for i_by, col in enumerate(by):
+        col_labels = np.append(np.asarray(labels[i_by], dtype=object), np.nan)
+        grp_df[col] = col_labels[grp_codes[:, i_by]]
+
+    return grps.reshape(-1), pd.DataFrame(grp_df).infer_objects()
+
+# function to sum the columns of vals, an array of shape (rows, columns), within
+# the groups of each row, returns an array of shape (groups, columns)
+def sum_groups(vals, grps, n_grps):
+    return np.stack([np.bincount(grps, weights=vals[:, i_cl], minlength=n_grps)
+                     for i_cl in range(vals.shape[1])], axis=-1)
+
+# function to convert the partial sums of the rows of a line type to the terms
+# that are summed within groups, returns the array of terms and the rows that
+# have all partial sums
+def get_terms(sums, line_type):
+    vals = sums[SUM_COLS[line_type]].to_numpy(dtype='float64')
+    total = vals[:, 0:1]
+    if line_type == 'sl1l2':
+        # means weighted by the number of matched pairs
+        terms = np.concatenate([total, total * vals[:, 1:]], axis=1)
+
+    elif line_type == 'nbrcnt':
+        # the reference of the fractions skill score, FBS / (1 - FSS), is the
+        # mean of squared forecast and observed fractions of each line, which
+        # is not defined by lines with FSS of 1 or NA, i.e., with an FBS of 0,
+        # so that these lines add nothing to the sums of the FSS and are only
+        # excluded from the FSS terms, as their reference is unknown
+        fbs, fss = vals[:, 1], vals[:, 2]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ref = fbs / (1 - fss)
+
+        has_ref = np.isfinite(ref)
+        terms = np.stack([total[:, 0], total[:, 0] * fbs,
+                          np.where(has_ref, total[:, 0] * fbs, 0.0),
+                          np.where(has_ref, total[:, 0] * ref, 0.0),
+                          total[:, 0] * vals[:, 3], total[:, 0] * vals[:, 4]],
+                         axis=1)
+
+    else:
+        terms = vals
+
+    return terms, np.isfinite(terms).all(axis=1)
+
+# function to compute the aggregate scores of a line type from the group sums
+# of its terms, an array of shape (..., terms), returns a dictionary of arrays
+def get_scores(terms, line_type):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if line_type == 'sl1l2':
+            n = terms[..., 0]
+            fbar, obar, fobar, ffbar, oobar, mae = [terms[..., i_tm] / n for
+                                                    i_tm in range(1, 7)]
+            mse = ffbar - 2 * fobar + oobar
+            fvar = ffbar - fbar**2
+            ovar = oobar - obar**2
+            me = fbar - obar
+            scores = {
+                      'TOTAL': n,
+                      'FBAR': fbar,
+                      'OBAR': obar,
+                      'ME': me,
+                      'MAE': mae,
+                      'MSE': mse,
+                      'RMSE': np.sqrt(mse),
+                      'BCMSE': mse - me**2,
+                      'ESTDEV': np.sqrt((mse - me**2) * n / (n - 1)),
+                      'FSTDEV': np.sqrt(fvar * n / (n - 1)),
+                      'OSTDEV': np.sqrt(ovar * n / (n - 1)),
+                      'MBIAS': fbar / obar,
+                      'PR_CORR': (fobar - fbar * obar) / np.sqrt(fvar * ovar),
+                     }
+
+        elif line_type == 'nbrcnt':
+            n = terms[..., 0]
+            fbs, f_rate, o_rate = [terms[..., i_tm] / n for i_tm in [1, 4, 5]]
+            scores = {
+                      'TOTAL': n,
+                      'FBS': fbs,
+                      'FSS': 1 - terms[..., 2] / terms[..., 3],
+                      'AFSS': 2 * f_rate * o_rate / (f_rate**2 + o_rate**2),
+                      'UFSS': 0.5 + o_rate / 2,
+                      'F_RATE': f_rate,
+                      'O_RATE': o_rate,
+                     }
+
+        else:
+            total, fy_oy, fy_on, fn_oy, fn_on = [terms[..., i_tm] for
+                                                 i_tm in range(5)]
+            fcst_y = fy_oy + fy_on
+            obs_y = fy_oy + fn_oy
+            obs_n = fy_on + fn_on
+            hits_rnd = fcst_y * obs_y / total
+            corr_rnd = (fcst_y * obs_y + (fn_oy + fn_on) * obs_n) / total
+            scores = {
+                      'TOTAL': total,
+                      'FY_OY': fy_oy,
+                      'FY_ON': fy_on,
+                      'FN_OY': fn_oy,
+                      'FN_ON': fn_on,
+                      'BASER': obs_y / total,
+                      'FMEAN': fcst_y / total,
+                      'ACC': (fy_oy + fn_on) / total,
+                      'FBIAS': fcst_y / obs_y,
+                      'PODY': fy_oy / obs_y,
+                      'PODN': fn_on / obs_n,
+                      'POFD': fy_on / obs_n,
+                      'FAR': fy_on / fcst_y,
+                      'CSI': fy_oy / (fcst_y + fn_oy),
+                      'GSS': (fy_oy - hits_rnd) / (fcst_y + fn_oy - hits_rnd),
+                      'HK': fy_oy / obs_y - fy_on / obs_n,
+                      'HSS': (fy_oy + fn_on - corr_rnd) / (total - corr_rnd),
+                     }
+
+    return scores
+
+# function to aggregate the partial sums of a line type within the groups of the
+# columns in by, returns a dataframe of the group labels, the number of lines
+# N_LINE and the aggregate scores of each group
+def aggregate_stats(sums, line_type, by=AGG_BY):
+    terms, rows = get_terms(sums, line_type)
+    grps, agg_df = get_groups(sums.loc[rows], by)
+    n_grps = len(agg_df.index)
+
+    agg_df['N_LINE'] = np.bincount(grps, minlength=n_grps)
+    scores = get_scores(sum_groups(terms[rows], grps, n_grps), line_type)
+    for stat, vals in scores.items():
+        agg_df[stat] = vals
+
+    return agg_df
+
+##################################################################################
+# Bootstrap confidence intervals
+##################################################################################
+# function to draw the number of times each of n_units units is resampled in
+# each of n_boot replicates, returns an array of shape (n_boot, n_units)
+def get_boot_counts(n_boot, n_units, seed=None):
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, n_units, size=(n_boot, n_units))
+    idx += np.arange(n_boot)[:, np.newaxis] * n_units
+
+    return np.bincount(idx.reshape(-1), minlength=n_boot * n_units).reshape(
+            n_boot, n_units).astype('float64')
+
+# function to compute the quantiles qs of the replicates along the first axis of
+# vals by linear interpolation, as np.nanpercentile with a single sort of all
+# columns, where replicates with undefined scores are excluded
+def get_percentiles(vals, qs):
+    vals = np.where(np.isfinite(vals), vals, np.nan)
+    vals.sort(axis=0)
+    n_vals = np.isfinite(vals).sum(axis=0)
+
+    bnds = []
+    for q in qs:
+        pos = q * np.maximum(n_vals - 1, 0)
+        lo = np.floor(pos).astype(int)
+        hi = np.minimum(lo + 1, np.maximum(n_vals - 1, 0))
+        v_lo = np.take_along_axis(vals, lo[np.newaxis], axis=0)[0]
+        v_hi = np.take_along_axis(vals, hi[np.newaxis], axis=0)[0]
+        bnd = v_lo + (pos - lo) * (v_hi - v_lo)
+        bnds.append(np.where(n_vals > 0, bnd, np.nan))
+
+    return np.array(bnds)
+
+# function to compute the percentile intervals of the scores of a chunk of
+# groups, where task is the bootstrap counts, the unit sums of the groups of
+# shape (groups, units, terms), the line type and significance level, returns a
+# dictionary of lower and upper bounds of each score
+def boot_intervals(task):
+    counts, unit_terms, line_type, alpha = task
+    n_grps, n_units, n_terms = unit_terms.shape
+
+    # replicate sums as one matrix product, of shape (replicates, groups, terms)
+    reps = np.matmul(counts, unit_terms.transpose(1, 0, 2).reshape(n_units, -1))
+    scores = get_scores(reps.reshape(-1, n_grps, n_terms), line_type)
+
+    bnds = {}
+    for stat, vals in scores.items():
+        if stat not in CNT_STATS:
+            bnds[stat] = get_percentiles(vals, [alpha / 2, 1 - alpha / 2])
+
+    return bnds
+
+# function to aggregate the partial sums of a line type within the groups of the
+# columns in by as aggregate_stats, with bootstrap confidence intervals of the
+# scores from n_boot replicates resampling the units of the column rsmpl,
+# returns the aggregates with the bounds of each score in STAT_BCL and STAT_BCU
+def bootstrap_stats(sums, line_type, by=AGG_BY, rsmpl=RSMPL, n_boot=N_BOOT,
+                    alpha=BOOT_ALPHA, seed=None, n_procs=None):
+    agg_df = aggregate_stats(sums, line_type, by)
+    if n_boot == 0 or len(agg_df.index) == 0:
+        return agg_df
+
+    terms, rows = get_terms(sums, line_type)
+    grps, _ = get_groups(sums.loc[rows], by)
+    units, _ = pd.factorize(sums.loc[rows, rsmpl], sort=True)
+    n_grps = len(agg_df.index)
+    n_units = units.max() + 1
+
+    # partial sums of each group and unit, of shape (groups, units, terms)
+    unit_terms = sum_groups(terms[rows], grps * n_units + units,
+                            n_grps * n_units).reshape(n_grps, n_units, -1)
+
+    # the same replicates of units are used for all groups
+    counts = get_boot_counts(n_boot, n_units, seed)
+    tasks = [[counts, unit_terms[i_gp:i_gp + BOOT_CHNK], line_type, alpha]
+             for i_gp in range(0, n_grps, BOOT_CHNK)]
+
+    if n_procs is None:
+        n_procs = max(multiprocessing.cpu_count() - 1, 1)
+
+    n_procs = min(n_procs, len(tasks))
+    if n_procs > 1:
+        with Pool(n_procs) as pool:
+            chnk_bnds = pool.map(boot_intervals, tasks)
+
+    else:
+        chnk_bnds = [boot_intervals(task) for task in tasks]
+
+    # place the bounds after each score as in MET outputs
+    boot_df = {}
+    for col in agg_df.columns:
+        boot_df[col] = agg_df[col].values
+        if col in chnk_bnds[0].keys():
+            bnds = np.concatenate([bnds[col] for bnds in chnk_bnds], axis=1)
+            boot_df[col + '_BCL'] = bnds[0]
+            boot_df[col + '_BCU'] = bnds[1]
+
+    return pd.DataFrame(boot_df, index=agg_df.index)
+
+# run lines if executed as a script
+if __name__ == '__main__':
+    import post_processing_config as config
+    from gridstat_paths import OUT_ROOT
+
+    # aggregate the cycles of the configured period and control flows
+    cycles = pd.date_range(start=pd.to_datetime(config.STRT_DT, format='%Y%m%d%H'),
+                           end=pd.to_datetime(config.END_DT, format='%Y%m%d%H'),
+                           freq=config.CYC_INT + 'H').strftime('%Y%m%d%H')
+
+    sums = load_sums(OUT_ROOT, AGG_TYPE, ctr_flws=config.CTR_FLWS,
+                     grds=config.GRDS, prfxs=config.PRFXS, cycles=list(cycles))
+
+    agg_df = bootstrap_stats(sums, AGG_TYPE, AGG_BY)
+
+    out_path = OUT_ROOT + '/gridstat_agg_' + AGG_TYPE + '_' + config.STRT_DT +\
+               '_' + config.END_DT + '.bin'
+
+    print('Writing ' + str(len(agg_df.index)) + ' aggregates of ' +\
+            str(len(sums.index)) + ' lines to ' + out_path)
+
+    with open(out_path, 'wb') as f:
+        pickle.dump(agg_df, f)
+
+##################################################################################
+# end
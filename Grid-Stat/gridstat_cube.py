@@ -0,0 +1,433 @@
+##################################################################################
+# Description
+##################################################################################
+# This module materializes the statistics stores below a root directory as
+# labeled, dense arrays with the dimensions
+#
+#     (CTR_FLW, GRD, PRFX, FCST_VAR, FCST_LEV, INTERP_PNTS, VX_MASK, INIT,
+#      LEAD_HR, FCST_THRESH, STAT)
+#
+# one cube per line type, where INIT is the forecast initialization time, STAT
+# ranges over the numeric statistics and counts of the line type, and cells
+# without a statistic are NaN. Plots and analyses then select their data by array
+# indexing with the coordinate labels instead of searching dataframes. Each row
+# of a store defines one cell of each statistic, and cubes are not built from
+# stores with rows that share coordinates, as their cells have no single value.
+# Each cube is written below the root as
+#
+#     ROOT/gridstat_cube/<line_type>/values.npy
+#     ROOT/gridstat_cube/<line_type>/_coords.json
+#
+# where values.npy is a float32 NumPy array, memory-mapped when read, and the
+# JSON file lists the dimensions, their coordinate labels and the modification
+# times of the stores the cube was built from, so that unchanged cubes are not
+# rebuilt. Initialization times are labeled by ISO strings, e.g.,
+# '2022121400' is labeled '2022-12-14T00:00:00', and leads by integer hours.
+#
+# The array is stored in chunks along the leading dimensions, where the values
+# of one control flow, grid and prefix are a contiguous block of values.npy
+# that is written once when the cube is built, and read alone when a plot
+# selects one configuration from the memory-mapped cube.
+#
+##################################################################################
+# License Statement
+##################################################################################
+#
+# Copyright 2023 CW3E, Contact Colin Grudzien cgrudzien@ucsd.edu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+#
+##################################################################################
+# Imports
+##################################################################################
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+from met_line_types import HDR_COLS, NUM_COLS
+from gridstat_store import MMAP_MD, read_schemas, read_stats, replace_store,\
+        read_manifest
+from gridstat_index import load_index, list_stores
+from gridstat_db import get_store_keys
+
+##################################################################################
+# SET GLOBAL PARAMETERS
+##################################################################################
+# directory of the cubes at the top of the root
+CUBE_DIR = 'gridstat_cube'
+
+# file names of the cube values and coordinates
+VALS_F = 'values.npy'
+CRDS_F = '_coords.json'
+
+# version of the cube layout, cubes of another version are rebuilt
+CUBE_VRSN = 2
+
+# dimensions of the cubes in order, where the leading dimensions of the store
+# keys define the chunks of the array
+DIMS = ['CTR_FLW', 'GRD', 'PRFX', 'FCST_VAR', 'FCST_LEV', 'INTERP_PNTS',
+        'VX_MASK', 'INIT', 'LEAD_HR', 'FCST_THRESH', 'STAT']
+
+# number of leading dimensions of the store keys
+N_KEYS = 3
+
+# columns of the stores defining the row coordinates, in the order of DIMS
+ROW_COLS = ['FCST_VAR', 'FCST_LEV', 'INTERP_PNTS', 'VX_MASK', 'INIT_DT',
+            'LEAD_HR', 'FCST_THRESH']
+
+# columns of row coordinates labeled by strings
+LAB_COLS = ['FCST_VAR', 'FCST_LEV', 'VX_MASK', 'FCST_THRESH']
+
+# dimensions of the verified fields and interpolation, which plots do not
+# select but merge with merge_dims
+VAR_DIMS = ['FCST_VAR', 'FCST_LEV', 'INTERP_PNTS']
+
+# label of missing values of string coordinates, e.g., the thresholds of
+# continuous statistics, as written by MET
+NA_LAB = 'NA'
+
+##################################################################################
+# Cube construction
+##################################################################################
+# function to list the statistics columns of a line type in a store, the numeric
+# columns other than the header and derived numeric columns
+def get_stat_cols(store_path, line_type):
+    stats = []
+    for schema in read_schemas(store_path, line_type):
+        for col in schema['columns']:
+            if col['dtype'].startswith(('int', 'float')) and\
+                    col['name'] not in stats + HDR_COLS + NUM_COLS:
+                stats.append(col['name'])
+
+    return stats
+
+# function to convert a categorical column to labels, with missing values
+# labeled NA_LAB
+def fill_labels(vals):
+    vals = vals.astype('category')
+    if vals.isna().any():
+        if NA_LAB not in vals.cat.categories:
+            vals = vals.cat.add_categories([NA_LAB])
+
+        vals = vals.fillna(NA_LAB)
+
+    return vals
+
+# function to convert a coordinate label to its stored form
+def to_label(dim, val):
+    if dim == 'INIT':
+        return str(pd.Timestamp(val).to_datetime64().astype('datetime64[s]'))
+
+    if dim in ['LEAD_HR', 'INTERP_PNTS']:
+        return int(val)
+
+    return val
+
+# function to find the positions of the values of a series in the coordinate
+# labels crds, where values that are not labels are given position -1
+def get_positions(crds, vals):
+    if isinstance(vals.dtype, pd.CategoricalDtype):
+        pos = pd.Index(crds).get_indexer(vals.cat.categories.astype(str))
+        return np.append(pos, -1)[vals.cat.codes.values]
+
+    return pd.Index(crds).get_indexer(vals.values)
+
+# function to fill the chunks of the leading dimensions of a cube, vals, with
+# the rows of the stores of each chunk in chunks, where each chunk is filled in
+# memory and written once, raises a ValueError if rows share coordinates
+def fill_chunks(vals, crds, chunks, line_type):
+    shape = vals.shape
+    row_dims = DIMS[N_KEYS:-1]
+    stats = crds['STAT']
+    init_crds = np.array(crds['INIT'], dtype='datetime64[s]')
+    for i_ch in np.ndindex(shape[:N_KEYS]):
+        # fill each chunk in memory and write it once
+        chunk = np.full(shape[N_KEYS:], np.nan, dtype='float32')
+        filled = np.zeros(shape[N_KEYS:-1], dtype=bool)
+        for store_path, keys, store_stats, store_df in chunks.get(i_ch, []):
+            # positions of the rows along each dimension
+            pos = []
+            for dim, col in zip(row_dims, ROW_COLS):
+                if dim == 'INIT':
+                    pos.append(pd.Index(init_crds).get_indexer(
+                            store_df[col].values.astype('datetime64[s]')))
+
+                else:
+                    pos.append(get_positions(crds[dim], store_df[col]))
+
+            rows = np.logical_and.reduce([i_ps >= 0 for i_ps in pos])
+            cells = tuple(i_ps[rows] for i_ps in pos)
+            flat = np.ravel_multi_index(cells, filled.shape)
+            if len(np.unique(flat)) < len(flat) or filled.flat[flat].any():
+                raise ValueError('rows of ' + store_path + ' share ' +\
+                        'coordinates of the ' + line_type + ' cube')
+
+            filled.flat[flat] = True
+            i_st = np.array([stats.index(stat) for stat in store_stats],
+                            dtype=int)
+
+            chunk[tuple(i_ps[:, np.newaxis] for i_ps in cells) +\
+                  (i_st[np.newaxis, :],)] =\
+                    store_df.loc[rows, store_stats].to_numpy(dtype='float32')
+
+        vals[i_ch] = chunk
+
+# function to build the cube of a line type from the stores below root, where
+# the cube is only rebuilt if stores were written, removed or re-processed since
+# it was built, returns the number of stores in a rebuilt cube or zero
+def build_cube(root, line_type, force=False):
+    root = root.rstrip('/')
+    cube_path = root + '/' + CUBE_DIR + '/' + line_type
+    index = load_index(root)
+    store_paths = sorted([rec['path'] for rec in list_stores(index)
+                          if not rec['name'].endswith('.bin') and
+                          os.path.isdir(rec['path'] + '/' + line_type)])
+
+    # stores are replaced as a whole when re-processed, changing the
+    # modification time of the store directory
+    stamps = {store_path: os.stat(store_path).st_mtime_ns
+              for store_path in store_paths}
+
+    if not force:
+        try:
+            with open(cube_path + '/' + CRDS_F) as f:
+                old_crds = json.load(f)
+
+            if old_crds['version'] == CUBE_VRSN and\
+                    old_crds['stamps'] == stamps:
+                return 0
+
+        except (OSError, ValueError, KeyError):
+            pass
+
+    # load the coordinate and statistics columns of every store
+    store_dfs = []
+    stats = []
+    for store_path in store_paths:
+        try:
+            keys = get_store_keys(store_path, read_manifest(store_path))
+            store_stats = get_stat_cols(store_path, line_type)
+            store_df = read_stats(store_path, line_type,
+                                  columns=ROW_COLS + store_stats)
+
+        except Exception as err:
+            print('WARNING: store ' + store_path + ' could not be loaded ' +\
+                    'to the ' + line_type + ' cube, skipping this store: ' +\
+                    str(err))
+            continue
+
+        for col in LAB_COLS:
+            store_df[col] = fill_labels(store_df[col])
+
+        store_dfs.append((store_path, keys, store_stats, store_df))
+        stats += [stat for stat in store_stats if stat not in stats]
+
+    if len(store_dfs) == 0:
+        return 0
+
+    # coordinate labels in sorted order
+    crds = {}
+    for i_dm, dim in enumerate(DIMS[:N_KEYS]):
+        crds[dim] = sorted(set([keys[i_dm] for _, keys, _, _ in store_dfs]))
+
+    row_dims = DIMS[N_KEYS:-1]
+    for dim in row_dims:
+        crds[dim] = set()
+
+    for _, _, _, store_df in store_dfs:
+        for dim, col in zip(row_dims, ROW_COLS):
+            if col in LAB_COLS:
+                crds[dim].update(store_df[col].astype(str).unique())
+
+            else:
+                crds[dim].update(store_df[col].dropna().unique())
+
+    for dim in row_dims:
+        crds[dim] = [to_label(dim, val) for val in sorted(crds[dim])]
+
+    crds['STAT'] = stats
+
+    # group the stores by their chunk of the leading dimensions
+    shape = tuple(len(crds[dim]) for dim in DIMS)
+    chunks = {}
+    for store in store_dfs:
+        i_ch = tuple(crds[dim].index(key) for dim, key in
+                     zip(DIMS[:N_KEYS], store[1]))
+        chunks.setdefault(i_ch, []).append(store)
+
+    # write the cube to a temporary directory moved into place when complete
+    tmp_path = cube_path + '.tmp'
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+
+    os.makedirs(tmp_path)
+    vals = np.lib.format.open_memmap(tmp_path + '/' + VALS_F, mode='w+',
+                                     dtype='float32', shape=shape)
+
+    try:
+        fill_chunks(vals, crds, chunks, line_type)
+
+    except:
+        # remove any previous cube, which no longer represents the stores
+        del vals
+        shutil.rmtree(tmp_path)
+        if os.path.isdir(cube_path):
+            shutil.rmtree(cube_path)
+
+        raise
+
+    vals.flush()
+    del vals
+
+    with open(tmp_path + '/' + CRDS_F, 'w') as f:
+        json.dump({'version': CUBE_VRSN, 'line_type': line_type, 'dims': DIMS,
+                   'coords': crds, 'stamps': stamps}, f)
+
+    replace_store(tmp_path, cube_path)
+
+    return len(store_dfs)
+
+# function to build the cubes of all line types of the stores below root,
+# returns the line types of the cubes that were rebuilt
+def build_cubes(root, line_types=None, force=False):
+    root = root.rstrip('/')
+    if line_types is None:
+        index = load_index(root)
+        line_types = set()
+        for rec in list_stores(index):
+            if not rec['name'].endswith('.bin'):
+                line_types.update([name for name in os.listdir(rec['path'])
+                                   if not name.startswith('_')])
+
+        line_types = sorted(line_types)
+
+    built = []
+    for line_type in line_types:
+        try:
+            if build_cube(root, line_type, force=force) > 0:
+                built.append(line_type)
+
+        except Exception as err:
+            print('WARNING: ' + line_type + ' cube could not be built below ' +\
+                    root + ': ' + str(err))
+
+    return built
+
+##################################################################################
+# Cube selection
+##################################################################################
+# function to load the cube of a line type below root, returns the memory-mapped
+# values and the coordinate labels of each dimension
+def read_cube(root, line_type):
+    cube_path = root.rstrip('/') + '/' + CUBE_DIR + '/' + line_type
+    with open(cube_path + '/' + CRDS_F) as f:
+        crds = json.load(f)['coords']
+
+    return np.load(cube_path + '/' + VALS_F, mmap_mode=MMAP_MD), crds
+
+# function to select labels along dimensions of a cube, given as keyword
+# arguments of a label or a list of labels for each dimension, where a single
+# label removes its dimension and a list keeps the labels found in the cube,
+# returns the selected values and the coordinate labels of remaining dimensions
+def select_cube(vals, crds, **sel):
+    dims = list(crds.keys())
+    idx = []
+    sel_crds = {}
+    for dim in dims:
+        if dim not in sel.keys():
+            idx.append(slice(None))
+            sel_crds[dim] = crds[dim]
+
+        elif isinstance(sel[dim], (list, tuple, np.ndarray, pd.Index)):
+            labels = [to_label(dim, val) for val in sel[dim]]
+            labels = [label for label in labels if label in crds[dim]]
+            idx.append(np.array([crds[dim].index(label) for label in labels],
+                                dtype=int))
+            sel_crds[dim] = labels
+
+        else:
+            label = to_label(dim, sel[dim])
+            if label not in crds[dim]:
+                raise KeyError(str(sel[dim]) + ' is not a label of ' + dim)
+
+            idx.append(crds[dim].index(label))
+
+    # index one dimension at a time so that lists of labels are not broadcast
+    for i_dm in range(len(dims) - 1, -1, -1):
+        if not isinstance(idx[i_dm], slice):
+            vals = np.take(vals, idx[i_dm], axis=i_dm)
+
+    return vals, sel_crds
+
+# function to merge dimensions dims of selected values, e.g., the verified
+# fields that a plot does not select, where cells with a statistic at a single
+# label of the merged dimensions take that statistic and cells with statistics
+# at several labels are NaN, as no single value is defined, returns the merged
+# values and the coordinate labels of the remaining dimensions
+def merge_dims(vals, crds, dims):
+    axes = tuple(i_dm for i_dm, dim in enumerate(crds.keys()) if dim in dims)
+    dfnd = ~np.isnan(vals)
+    merged = np.where(dfnd, vals, 0).sum(axis=axes, dtype=vals.dtype)
+    merged[dfnd.sum(axis=axes) != 1] = np.nan
+
+    return merged, {dim: labels for dim, labels in crds.items()
+                    if dim not in dims}
+
+# function to list the labels of a dimension dim of selected values with any
+# defined value, e.g., the leads with statistics
+def defined_labels(vals, crds, dim):
+    dims = list(crds.keys())
+    axes = tuple(i_dm for i_dm in range(len(dims)) if dims[i_dm] != dim)
+    dfnd = (~np.isnan(vals)).any(axis=axes)
+
+    return [label for label, is_dfnd in zip(crds[dim], dfnd) if is_dfnd]
+
+# function to arrange selected values with leading dimensions INIT and LEAD_HR
+# by lead and valid time, valid_dts, where the initialization of each cell is
+# the valid time less the lead, returns an array of shape (leads, valid times)
+# followed by any remaining dimensions
+def lead_valid(vals, crds, leads, valid_dts):
+    init_crds = np.array(crds['INIT'], dtype='datetime64[s]')
+    lead_crds = np.array(crds['LEAD_HR'], dtype=int)
+    leads = np.array(leads, dtype=int)
+    valid_dts = np.array([to_label('INIT', valid_dt) for valid_dt in valid_dts],
+                         dtype='datetime64[s]')
+
+    inits = valid_dts[np.newaxis, :] - leads[:, np.newaxis].astype(
+            'timedelta64[h]')
+
+    out = np.full(inits.shape + vals.shape[2:], np.nan)
+    if len(init_crds) == 0 or len(lead_crds) == 0:
+        return out
+
+    i_it = np.searchsorted(init_crds, inits)
+    i_ld = np.searchsorted(lead_crds, leads)
+    i_it[i_it == len(init_crds)] = 0
+    i_ld[i_ld == len(lead_crds)] = 0
+    cells = (init_crds[i_it] == inits) & (lead_crds[i_ld] == leads)[:, np.newaxis]
+
+    out[cells] = vals[i_it[cells], np.broadcast_to(i_ld[:, np.newaxis],
+                                                   inits.shape)[cells]]
+
+    return out
+
+# run lines if executed as a script
+if __name__ == '__main__':
+    from gridstat_paths import OUT_ROOT
+
+    built = build_cubes(OUT_ROOT)
+    print('Built cubes of line types ' + str(built) + ' below ' + OUT_ROOT)
+
+##################################################################################
+# end
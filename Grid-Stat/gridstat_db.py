@@ -0,0 +1,388 @@
+##################################################################################
+# Description
+##################################################################################
+# This module maintains an embedded SQLite database of all processed Grid-Stat
+# statistics, synchronized from the columnar statistics stores written by
+# proc_gridstat.py, with a query function that pushes the selection of columns
+# and the filtering of rows down into the database. The database holds one table
+# per line type, with the columns of the stores and the keys
+#
+#     CTR_FLW  - control flow of the store
+#     GRD      - grid of the store, empty string if not used
+#     PRFX     - Grid-Stat output prefix of the store, empty string if not used
+#     CYCLE    - valid start date of the store, YYYYMMDDHH
+#     STORE_ID - identifier of the store in the _stores table
+#     LINE     - line number of the row within the store
+#
+# where each table has a composite index on
+#
+#     (CTR_FLW, GRD, VX_MASK, FCST_LEAD, FCST_VALID_END, FCST_THRESH)
+#
+# so that the slice of a plot is found without scanning other rows. Datetime
+# columns are stored as 'YYYY-MM-DD HH:MM:SS' strings that sort in time order.
+# Stores are re-loaded only when they are re-written, so that syncing after
+# each run of proc_gridstat.py only loads new or re-processed cycles. There is
+# no server process, the database is a single file, e.g.,
+#
+#     OUT_ROOT/gridstat_stats.db
+#
+# Run as a script, this module syncs the stores below OUT_ROOT to the database.
+#
+##################################################################################
+# License Statement
+##################################################################################
+#
+# Copyright 2023 CW3E, Contact Colin Grudzien cgrudzien@ucsd.edu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+#
+##################################################################################
+# Imports
+##################################################################################
+import os
+import sqlite3
+import datetime
+import numpy as np
+import pandas as pd
+from met_line_types import CAT_COLS, INT_COLS, F64_TYPES
+from gridstat_store import read_manifest, list_line_types, read_stats
+from gridstat_index import load_index, list_stores
+
+##################################################################################
+# SET GLOBAL PARAMETERS
+##################################################################################
+# database file name at the top of the synced root
+DB_F = 'gridstat_stats.db'
+
+# key columns identifying the store of each row
+KEY_COLS = ['CTR_FLW', 'GRD', 'PRFX', 'CYCLE', 'STORE_ID', 'LINE']
+
+# columns of the composite index of each line type table
+IDX_COLS = ['CTR_FLW', 'GRD', 'VX_MASK', 'FCST_LEAD', 'FCST_VALID_END',
+            'FCST_THRESH']
+
+# datetime columns, stored as strings in DT_FMT
+DT_COLS = ['VALID_DT', 'INIT_DT']
+DT_FMT = '%Y-%m-%d %H:%M:%S'
+
+# number of rows inserted per statement batch
+INS_SZ = 10000
+
+# standard string indentation
+STR_INDT = '    '
+
+##################################################################################
+# Database connection and schema
+##################################################################################
+# function to open the database, where write-ahead logging lets plotting
+# scripts read while a sync is writing
+def connect_db(db_path):
+    con = sqlite3.connect(db_path)
+    con.execute('PRAGMA journal_mode=WAL')
+    con.execute('PRAGMA synchronous=NORMAL')
+    con.execute('CREATE TABLE IF NOT EXISTS _stores (STORE_ID INTEGER ' +\
+                'PRIMARY KEY, PATH TEXT UNIQUE, STAMP INTEGER, CTR_FLW TEXT, ' +\
+                'GRD TEXT, PRFX TEXT, CYCLE TEXT)')
+
+    return con
+
+# function to list the line type tables of the database
+def list_tables(con):
+    return sorted([row[0] for row in con.execute('SELECT name FROM ' +\
+            'sqlite_master WHERE type=\'table\' AND name NOT LIKE \'\\_%\' ' +\
+            'ESCAPE \'\\\'')])
+
+# function to list the columns of a line type table
+def list_table_columns(con, line_type):
+    return [row[1] for row in con.execute('PRAGMA table_info("' + line_type +\
+                                          '")')]
+
+# function to create the table of a line type with its indices, or to add the
+# columns of a dataframe that are missing from an existing table
+def ensure_table(con, line_type, cols):
+    tbl_cols = list_table_columns(con, line_type)
+    if len(tbl_cols) == 0:
+        con.execute('CREATE TABLE "' + line_type + '" (' +\
+                    ', '.join('"' + col + '"' for col in KEY_COLS + cols) + ')')
+
+        idx_cols = [col for col in IDX_COLS if col in KEY_COLS + cols]
+        con.execute('CREATE INDEX "idx_' + line_type + '_slice" ON "' +\
+                    line_type + '" (' + ', '.join(idx_cols) + ')')
+
+        con.execute('CREATE INDEX "idx_' + line_type + '_store" ON "' +\
+                    line_type + '" (STORE_ID)')
+
+    else:
+        for col in cols:
+            if col not in tbl_cols:
+                con.execute('ALTER TABLE "' + line_type + '" ADD COLUMN "' +\
+                            col + '"')
+
+##################################################################################
+# Synchronization with statistics stores
+##################################################################################
+# function to obtain the control flow, grid, prefix and cycle of a store from
+# its manifest, where stores with manifests written before these keys were
+# recorded are assumed to have an empty prefix and the grid as the remainder of
+# the store name, grid_stats_GRD_YYYYMMDDHH
+def get_store_keys(store_path, manifest):
+    if manifest is not None and 'cycle' in manifest.keys():
+        return manifest['ctr_flw'], manifest['grid'], manifest['prfx'],\
+               manifest['cycle']
+
+    split_path = store_path.rstrip('/').split('/')
+    cycle = split_path[-2]
+    grid = split_path[-1][len('grid_stats'):-len('_' + cycle)].lstrip('_')
+
+    return split_path[-3], grid, '', cycle
+
+# function to convert a dataframe read from a store to the columns of the rows
+# for insertion, converted column-wise and prefixed by the key values and line
+# number, where categories and datetimes are written as strings and missing
+# values as NULL, returns a list of object arrays in the order of KEY_COLS and
+# the columns of the dataframe
+def to_cols(df, keys):
+    cols = [np.full(len(df.index), key, dtype=object) for key in keys]
+    cols.append(df.index.values.astype(object))
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            vals = df[col].dt.strftime(DT_FMT).values.astype(object)
+
+        else:
+            vals = np.asarray(df[col].values).astype(object)
+
+        vals[pd.isna(vals)] = None
+        cols.append(vals)
+
+    return cols
+
+# function to load all line types of a store into the database, replacing any
+# rows previously loaded from the store
+def load_store(con, store_path, stamp, keys):
+    ctr_flw, grid, prfx, cycle = keys
+    with con:
+        row = con.execute('SELECT STORE_ID FROM _stores WHERE PATH=?',
+                          (store_path,)).fetchone()
+
+        if row is None:
+            store_id = con.execute('INSERT INTO _stores (PATH, STAMP, ' +\
+                    'CTR_FLW, GRD, PRFX, CYCLE) VALUES (?, ?, ?, ?, ?, ?)',
+                    (store_path, stamp) + tuple(keys)).lastrowid
+
+        else:
+            store_id = row[0]
+            for line_type in list_tables(con):
+                con.execute('DELETE FROM "' + line_type + '" WHERE ' +\
+                            'STORE_ID=?', (store_id,))
+
+            con.execute('UPDATE _stores SET STAMP=?, CTR_FLW=?, GRD=?, ' +\
+                        'PRFX=?, CYCLE=? WHERE STORE_ID=?',
+                        (stamp,) + tuple(keys) + (store_id,))
+
+        for line_type in list_line_types(store_path):
+            stat_df = read_stats(store_path, line_type)
+            if stat_df.empty:
+                continue
+
+            cols = list(stat_df.columns)
+            row_cols = to_cols(stat_df, [ctr_flw, grid, prfx, cycle, store_id])
+
+            ensure_table(con, line_type, cols)
+            ins = 'INSERT INTO "' + line_type + '" (' +\
+                  ', '.join('"' + col + '"' for col in KEY_COLS + cols) +\
+                  ') VALUES (' + ', '.join(['?'] * (len(KEY_COLS) +\
+                  len(cols))) + ')'
+
+            # rows are zipped from the column slices without a copy per row
+            for i_r in range(0, len(stat_df.index), INS_SZ):
+                con.executemany(ins, zip(*[col[i_r:i_r + INS_SZ]
+                                           for col in row_cols]))
+
+# function to remove the rows of a store that no longer exists
+def drop_store(con, store_id):
+    with con:
+        for line_type in list_tables(con):
+            con.execute('DELETE FROM "' + line_type + '" WHERE STORE_ID=?',
+                        (store_id,))
+
+        con.execute('DELETE FROM _stores WHERE STORE_ID=?', (store_id,))
+
+# function to sync the database with the stores indexed below root, loading
+# stores with a new or changed manifest and dropping removed stores, returns
+# the number of stores loaded and dropped
+def sync_db(root, db_path=None):
+    root = root.rstrip('/')
+    if db_path is None:
+        db_path = root + '/' + DB_F
+
+    index = load_index(root)
+    store_paths = sorted([rec['path'] for rec in list_stores(index)
+                          if not rec['name'].endswith('.bin')])
+
+    con = connect_db(db_path)
+    old_stamps = {}
+    for store_id, path, stamp in con.execute('SELECT STORE_ID, PATH, STAMP ' +\
+                                             'FROM _stores'):
+        old_stamps[path] = (store_id, stamp)
+
+    num_load = 0
+    for store_path in store_paths:
+        try:
+            # stores are replaced as a whole by proc_gridstat.py, changing the
+            # modification time of the store directory, while the manifests of
+            # skipped configurations are rewritten in place
+            stamp = os.stat(store_path).st_mtime_ns
+
+            if store_path in old_stamps.keys() and\
+                    old_stamps[store_path][1] == stamp:
+                continue
+
+            keys = get_store_keys(store_path, read_manifest(store_path))
+            load_store(con, store_path, stamp, keys)
+            num_load += 1
+
+        except Exception as err:
+            print('WARNING: store ' + store_path + ' could not be loaded ' +\
+                    'to ' + db_path + ', skipping this store: ' + str(err))
+
+    num_drop = 0
+    for path, (store_id, stamp) in old_stamps.items():
+        if path not in store_paths:
+            drop_store(con, store_id)
+            num_drop += 1
+
+    con.close()
+
+    return num_load, num_drop
+
+##################################################################################
+# Queries
+##################################################################################
+# function to convert a filter value to its stored form
+def to_db_value(val):
+    if isinstance(val, (datetime.datetime, np.datetime64, pd.Timestamp)):
+        return pd.Timestamp(val).strftime(DT_FMT)
+
+    if isinstance(val, np.generic):
+        return val.item()
+
+    return val
+
+# function to restore the compact data types of the stores to a query result
+def apply_db_dtypes(df, line_type):
+    for col in df.columns:
+        if col in CAT_COLS or col in ['CTR_FLW', 'GRD', 'PRFX', 'CYCLE',
+                                      'THRESH_OP']:
+            df[col] = df[col].astype('category')
+
+        elif col in DT_COLS:
+            df[col] = pd.to_datetime(df[col], format=DT_FMT)
+
+        elif col in INT_COLS + ['LEAD_HR', 'STORE_ID', 'LINE']:
+            if df[col].notna().all():
+                df[col] = df[col].astype('int32')
+
+        elif not col.startswith('COL_'):
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(
+                    'float64' if line_type in F64_TYPES else 'float32')
+
+    return df
+
+# function to list the columns of a line type in the database, excluding keys
+def query_columns(db_path, line_type):
+    if not os.path.isfile(db_path):
+        raise FileNotFoundError('database ' + db_path + ' does not exist')
+
+    con = connect_db(db_path)
+    try:
+        tbl_cols = list_table_columns(con, line_type)
+
+    finally:
+        con.close()
+
+    if len(tbl_cols) == 0:
+        raise KeyError(line_type + ' is not a table of ' + db_path)
+
+    return [col for col in tbl_cols if col not in KEY_COLS]
+
+# function to query a line type from the database into a dataframe, optionally
+# selecting only the listed columns and only the rows matching the filters, a
+# dictionary of column names to a value or list of values, or to a pair
+# (lower, upper) for an inclusive range, where the selection and filtering are
+# made in the database using the composite index, e.g.,
+#
+#     query_stats(db_path, 'cnt', columns=['LEAD_HR', 'RMSE'],
+#                 filters={'CTR_FLW': 'NRT_gfs', 'GRD': 'd01',
+#                          'VX_MASK': 'CA_All', 'VALID_DT': (strt_dt, end_dt)})
+#
+def query_stats(db_path, line_type, columns=None, filters=None):
+    if filters is None:
+        filters = {}
+
+    if not os.path.isfile(db_path):
+        raise FileNotFoundError('database ' + db_path + ' does not exist')
+
+    con = connect_db(db_path)
+    try:
+        tbl_cols = list_table_columns(con, line_type)
+        if len(tbl_cols) == 0:
+            raise KeyError(line_type + ' is not a table of ' + db_path)
+
+        if columns is None:
+            columns = [col for col in tbl_cols if col not in KEY_COLS]
+
+        for col in list(columns) + list(filters.keys()):
+            if col not in tbl_cols:
+                raise KeyError(col + ' is not a column of ' + line_type +\
+                        ' in ' + db_path)
+
+        where = []
+        params = []
+        for col, vals in filters.items():
+            if isinstance(vals, tuple) and len(vals) == 2:
+                where.append('"' + col + '" BETWEEN ? AND ?')
+                params += [to_db_value(val) for val in vals]
+
+            else:
+                if not isinstance(vals, (list, set, np.ndarray)):
+                    vals = [vals]
+
+                vals = list(vals)
+                where.append('"' + col + '" IN (' +\
+                             ', '.join(['?'] * len(vals)) + ')')
+                params += [to_db_value(val) for val in vals]
+
+        sql = 'SELECT ' + ', '.join('"' + col + '"' for col in columns) +\
+              ' FROM "' + line_type + '"'
+        if len(where) > 0:
+            sql += ' WHERE ' + ' AND '.join(where)
+
+        stat_df = pd.read_sql_query(sql, con, params=params)
+
+    finally:
+        con.close()
+
+    return apply_db_dtypes(stat_df, line_type)
+
+# run lines if executed as a script
+if __name__ == '__main__':
+    from gridstat_paths import OUT_ROOT
+
+    print('Syncing statistics stores below ' + OUT_ROOT + ' to ' + OUT_ROOT +\
+            '/' + DB_F)
+    num_load, num_drop = sync_db(OUT_ROOT)
+    print(STR_INDT + 'Loaded ' + str(num_load) + ' stores, dropped ' +\
+            str(num_drop) + ' stores.')
+
+##################################################################################
+# end
@@ -0,0 +1,315 @@
+##################################################################################
+# Description
+##################################################################################
+# This module builds a persistent index of the Grid-Stat outputs and processed
+# statistics below a root directory, so that the post-processing scripts resolve
+# their inputs from one scan instead of a glob, isdir or failed open for each
+# configuration. The index records, for every directory below the root, its
+# modification time, its sub-directories, the grid_stat_* output files with their
+# size and modification time, and the grid_stats_* stores and binary files. The
+# index is written as a JSON file at the top of the root, e.g.,
+#
+#     OUT_ROOT/_gridstat_index.json
+#
+# and is refreshed by comparing directory modification times, where only the
+# directories with added, removed or renamed entries are listed again. Directory
+# modification times do not change when an existing file is rewritten in place,
+# such that the content checks of proc_gridstat.py are still made on the files.
+#
+# Records of grid_stat outputs are keyed by control flow, cycle, prefix, lead and
+# line type, parsed from paths of the form
+#
+#     ROOT/[CSE/]CTR_FLW/YYYYMMDDHH/grid_stat_PRFX_HHMMSSL_YYYYMMDD_HHMMSSV_type.txt
+#
+# and records of stores are keyed by control flow, cycle and store name.
+#
+##################################################################################
+# License Statement
+##################################################################################
+#
+# Copyright 2023 CW3E, Contact Colin Grudzien cgrudzien@ucsd.edu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+#
+##################################################################################
+# Imports
+##################################################################################
+import os
+import json
+from fnmatch import fnmatchcase
+
+##################################################################################
+# SET GLOBAL PARAMETERS
+##################################################################################
+# index file name at the top of the indexed root
+IDX_F = '_gridstat_index.json'
+
+# version of the index layout, indices of another version are rebuilt
+IDX_VRSN = 1
+
+# file name prefix of Grid-Stat outputs and processed statistics
+OUT_PRFX = 'grid_stat'
+
+##################################################################################
+# Index construction
+##################################################################################
+# function to list one directory, recording sub-directories to descend into,
+# grid_stat_* output files with their size and modification time in ns, and
+# grid_stats_* stores and binary files, where stores are not descended into and
+# temporary stores being written are skipped
+def scan_dir(dir_path):
+    dir_rec = {'mtime': os.stat(dir_path).st_mtime_ns, 'dirs': [],
+               'files': {}, 'stores': []}
+
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                if entry.name.startswith('grid_stats'):
+                    if not entry.name.endswith('.tmp'):
+                        dir_rec['stores'].append(entry.name)
+
+                elif not entry.name.startswith('.'):
+                    dir_rec['dirs'].append(entry.name)
+
+            elif entry.name.startswith('grid_stats'):
+                if entry.name.endswith('.bin'):
+                    dir_rec['stores'].append(entry.name)
+
+            elif entry.name.startswith(OUT_PRFX):
+                f_stat = entry.stat()
+                dir_rec['files'][entry.name] = [f_stat.st_size,
+                                                f_stat.st_mtime_ns]
+
+    dir_rec['dirs'].sort()
+    dir_rec['stores'].sort()
+
+    return dir_rec
+
+# function to refresh an index of root in one pass, directories with the same
+# modification time as recorded in the old index are reused without listing
+# them, so that a refresh of an unchanged tree costs one stat per directory
+def update_index(root, index=None):
+    old_dirs = {}
+    if index is not None and index.get('version') == IDX_VRSN and\
+            index.get('root') == root:
+        old_dirs = index['dirs']
+
+    new_dirs = {}
+    rel_dirs = ['']
+    while len(rel_dirs) > 0:
+        rel_dir = rel_dirs.pop()
+        dir_path = root + rel_dir
+        try:
+            mtime = os.stat(dir_path).st_mtime_ns
+            if rel_dir in old_dirs.keys() and old_dirs[rel_dir]['mtime'] == mtime:
+                dir_rec = old_dirs[rel_dir]
+
+            else:
+                dir_rec = scan_dir(dir_path)
+
+        except OSError:
+            # directories removed or unreadable during the scan are skipped
+            continue
+
+        new_dirs[rel_dir] = dir_rec
+        rel_dirs += [rel_dir + '/' + name for name in dir_rec['dirs']]
+
+    return {'version': IDX_VRSN, 'root': root, 'dirs': new_dirs}
+
+# function to load, refresh and write back the index of root, where the index is
+# rebuilt if it is missing or of another version, and is kept in memory only if
+# it cannot be written, e.g., for a read-only root
+def load_index(root, idx_path=None):
+    root = root.rstrip('/')
+    if idx_path is None:
+        idx_path = root + '/' + IDX_F
+
+    index = None
+    try:
+        with open(idx_path) as f:
+            index = json.load(f)
+
+    except (OSError, ValueError):
+        pass
+
+    index = update_index(root, index)
+
+    try:
+        # write to a process specific file moved into place so that concurrent
+        # scripts never read a partially written index
+        tmp_path = idx_path + '.' + str(os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+
+        os.replace(tmp_path, idx_path)
+
+    except OSError as err:
+        print('WARNING: index ' + idx_path + ' could not be written, ' +\
+                'using an in-memory index: ' + str(err))
+
+    return index
+
+##################################################################################
+# Index queries
+##################################################################################
+# function to split an absolute path into its directory relative to the
+# indexed root and its base name, returns None if the path is not below root
+def split_path(index, path):
+    path = path.rstrip('/')
+    root = index['root']
+    if not path.startswith(root + '/'):
+        return None
+
+    rel_path = path[len(root):]
+    i_sep = rel_path.rindex('/')
+
+    return rel_path[:i_sep], rel_path[i_sep + 1:]
+
+# function to resolve a glob pattern of Grid-Stat outputs or stores from the
+# index with the matching rules of glob.glob, where a trailing '/' matches
+# stores only, returning unsorted paths as glob.glob does
+def index_glob(index, pattern):
+    dir_only = pattern.endswith('/')
+    split_pttrn = split_path(index, pattern)
+    if split_pttrn is None:
+        return []
+
+    dir_pttrn, name_pttrn = split_pttrn
+    dir_pttrn = dir_pttrn.split('/')
+    root = index['root']
+    paths = []
+    for rel_dir, dir_rec in index['dirs'].items():
+        split_dir = rel_dir.split('/')
+        if len(split_dir) != len(dir_pttrn) or\
+                not all(fnmatchcase(name, pttrn) for name, pttrn in
+                        zip(split_dir, dir_pttrn)):
+            continue
+
+        names = [name for name in dir_rec['stores']
+                 if not (dir_only and name.endswith('.bin'))]
+
+        if not dir_only:
+            names += list(dir_rec['files'].keys())
+
+        for name in names:
+            if fnmatchcase(name, name_pttrn):
+                paths.append(root + rel_dir + '/' + name +\
+                             ('/' if dir_only else ''))
+
+    return paths
+
+# function to check if a Grid-Stat output or store exists in the index
+def has_path(index, path):
+    split_pth = split_path(index, path)
+    if split_pth is None:
+        return False
+
+    rel_dir, name = split_pth
+    if rel_dir not in index['dirs'].keys():
+        return False
+
+    dir_rec = index['dirs'][rel_dir]
+    return name in dir_rec['files'].keys() or name in dir_rec['stores']
+
+# function to obtain the size in bytes of an indexed Grid-Stat output, returns
+# zero for paths not in the index
+def get_size(index, path):
+    split_pth = split_path(index, path)
+    if split_pth is None or split_pth[0] not in index['dirs'].keys():
+        return 0
+
+    rel_dir, name = split_pth
+    return index['dirs'][rel_dir]['files'].get(name, [0, 0])[0]
+
+# function to parse the prefix, lead in HHMMSS and lower case line type from the
+# file name of a grid_stat_* output, where the line type of combined .stat files
+# is 'stat', returns None for names that are not Grid-Stat outputs
+def parse_gridstat_name(fname):
+    name, ext = os.path.splitext(fname)
+    split_name = name.split('_')
+    if ext == '.txt' and len(split_name) >= 6:
+        line_type = split_name[-1]
+        split_name = split_name[:-1]
+
+    elif ext == '.stat' and len(split_name) >= 5:
+        line_type = 'stat'
+
+    else:
+        return None
+
+    if split_name[:2] != ['grid', 'stat'] or not split_name[-1].endswith('V'):
+        return None
+
+    return '_'.join(split_name[2:-3]), split_name[-3].rstrip('L'), line_type
+
+# function to list the records of Grid-Stat outputs in the index, optionally
+# matching any of the keys control flow, cycle, prefix, lead and line type,
+# where the control flow and cycle are the directories above each file
+def list_outputs(index, ctr_flw=None, cycle=None, prfx=None, lead=None,
+                 line_type=None):
+    keys = {'ctr_flw': ctr_flw, 'cycle': cycle, 'prfx': prfx, 'lead': lead,
+            'line_type': line_type}
+
+    recs = []
+    for rel_dir, dir_rec in index['dirs'].items():
+        split_dir = rel_dir.split('/')
+        if len(split_dir) < 3:
+            continue
+
+        for fname, (size, mtime) in dir_rec['files'].items():
+            parsed = parse_gridstat_name(fname)
+            if parsed is None:
+                continue
+
+            rec = {'ctr_flw': split_dir[-2], 'cycle': split_dir[-1],
+                   'prfx': parsed[0], 'lead': parsed[1],
+                   'line_type': parsed[2], 'size': size,
+                   'path': index['root'] + rel_dir + '/' + fname}
+
+            if all(val is None or rec[key] == val for key, val in keys.items()):
+                recs.append(rec)
+
+    return recs
+
+# function to list the records of stores and binary files in the index,
+# optionally matching the control flow, cycle and store name
+def list_stores(index, ctr_flw=None, cycle=None, name=None):
+    keys = {'ctr_flw': ctr_flw, 'cycle': cycle, 'name': name}
+
+    recs = []
+    for rel_dir, dir_rec in index['dirs'].items():
+        split_dir = rel_dir.split('/')
+        if len(split_dir) < 3:
+            continue
+
+        for store in dir_rec['stores']:
+            rec = {'ctr_flw': split_dir[-2], 'cycle': split_dir[-1],
+                   'name': store, 'path': index['root'] + rel_dir + '/' + store}
+
+            if all(val is None or rec[key] == val for key, val in keys.items()):
+                recs.append(rec)
+
+    return recs
+
+# run lines if executed as a script
+if __name__ == '__main__':
+    from gridstat_paths import IN_ROOT, OUT_ROOT
+
+    for root in sorted(set([IN_ROOT, OUT_ROOT])):
+        index = load_index(root)
+        print('Indexed ' + str(len(list_outputs(index))) + ' Grid-Stat ' +\
+                'outputs and ' + str(len(list_stores(index))) + ' stores in ' +\
+                str(len(index['dirs'])) + ' directories below ' + root)
+
+##################################################################################
+# end
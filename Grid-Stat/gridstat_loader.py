@@ -0,0 +1,175 @@
+##################################################################################
+# Description
+##################################################################################
+# This module is the shared data access layer of the plotting scripts, loading
+# processed statistics through an in-process, memory-bounded cache with least
+# recently used eviction. The columns of each statistics store are cached as they
+# are read, keyed by store path, line type and column, so that when several
+# figures are produced in one process, e.g., for many control flows, grids or
+# valid dates, each column file of a store is read at most once, and only the
+# columns that are requested are read at all. Row filters are then applied to
+# the cached columns in memory. The index of the stores below a root directory
+# and pickled binary files of legacy scripts are cached in the same way.
+#
+# The cache is bounded by CACHE_SZ bytes of dataframe memory, where the least
+# recently used columns are evicted first when the bound is exceeded.
+#
+##################################################################################
+# License Statement
+##################################################################################
+#
+# Copyright 2023 CW3E, Contact Colin Grudzien cgrudzien@ucsd.edu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+#
+##################################################################################
+# Imports
+##################################################################################
+import pickle
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from gridstat_store import read_columns, read_stats
+from gridstat_index import load_index
+
+##################################################################################
+# SET GLOBAL PARAMETERS
+##################################################################################
+# maximum bytes of cached dataframe memory before least recently used entries
+# are evicted
+CACHE_SZ = 2**31
+
+##################################################################################
+# Least recently used cache
+##################################################################################
+# cached entries keyed by tuples, with their size in bytes, in order of use
+CACHE = OrderedDict()
+
+# counters of cache use, bytes held and columns read from disk
+CACHE_STATS = {'hits': 0, 'misses': 0, 'bytes': 0, 'evictions': 0}
+
+# function to compute the memory of a cached value in bytes
+def get_nbytes(val):
+    if isinstance(val, (pd.Series, pd.DataFrame)):
+        return int(np.sum(val.memory_usage(deep=True)))
+
+    if isinstance(val, dict):
+        return sum(get_nbytes(sub_val) for sub_val in val.values())
+
+    return 0
+
+# function to look up a cached value, marking it as most recently used, returns
+# None if the key is not cached
+def get_cached(key):
+    if key not in CACHE.keys():
+        CACHE_STATS['misses'] += 1
+        return None
+
+    CACHE.move_to_end(key)
+    CACHE_STATS['hits'] += 1
+
+    return CACHE[key][0]
+
+# function to cache a value and evict least recently used entries beyond
+# CACHE_SZ, where the newest entry is always kept
+def put_cached(key, val):
+    if key in CACHE.keys():
+        CACHE_STATS['bytes'] -= CACHE.pop(key)[1]
+
+    nbytes = get_nbytes(val)
+    CACHE[key] = (val, nbytes)
+    CACHE_STATS['bytes'] += nbytes
+    while CACHE_STATS['bytes'] > CACHE_SZ and len(CACHE) > 1:
+        old_key, (old_val, old_nbytes) = CACHE.popitem(last=False)
+        CACHE_STATS['bytes'] -= old_nbytes
+        CACHE_STATS['evictions'] += 1
+
+    return val
+
+# function to empty the cache, e.g., in long running processes before reading
+# stores that have been re-processed
+def clear_cache():
+    CACHE.clear()
+    for key in CACHE_STATS.keys():
+        CACHE_STATS[key] = 0
+
+##################################################################################
+# Loading routines
+##################################################################################
+# function to obtain the index of the stores below root, loaded once per process
+def get_index(root):
+    key = ('index', root)
+    index = get_cached(key)
+    if index is None:
+        index = put_cached(key, load_index(root))
+
+    return index
+
+# function to list the columns of a line type in a store, as read_columns
+def load_columns(store_path, line_type):
+    key = ('columns', store_path, line_type)
+    cols = get_cached(key)
+    if cols is None:
+        cols = put_cached(key, read_columns(store_path, line_type))
+
+    return cols
+
+# function to load a line type of a store as read_stats, where all rows of the
+# requested and filtered columns are cached and filters are applied in memory
+def load_stats(store_path, line_type, columns=None, filters=None):
+    if filters is None:
+        filters = {}
+
+    if columns is None:
+        columns = load_columns(store_path, line_type)
+
+    load_cols = list(columns) + [col for col in filters.keys()
+                                 if col not in columns]
+
+    col_vals = {}
+    read_cols = []
+    for col in load_cols:
+        col_vals[col] = get_cached(('column', store_path, line_type, col))
+        if col_vals[col] is None:
+            read_cols.append(col)
+
+    if len(read_cols) > 0:
+        read_df = read_stats(store_path, line_type, columns=read_cols)
+        for col in read_cols:
+            col_vals[col] = put_cached(('column', store_path, line_type, col),
+                                       read_df[col])
+
+    stat_df = pd.concat([col_vals[col] for col in load_cols], axis=1)
+
+    # find the rows matching all filters
+    rows = np.ones(len(stat_df.index), dtype=bool)
+    for col, vals in filters.items():
+        if not isinstance(vals, (list, tuple, set)):
+            vals = [vals]
+
+        rows &= stat_df[col].isin(list(vals)).values
+
+    return stat_df.loc[rows, list(columns)]
+
+# function to load the dictionary of dataframes of a pickled binary file
+def load_bin(in_path):
+    key = ('bin', in_path)
+    data = get_cached(key)
+    if data is None:
+        with open(in_path, 'rb') as f:
+            data = put_cached(key, pickle.load(f))
+
+    return data
+
+##################################################################################
+# end
@@ -0,0 +1,43 @@
+##################################################################################
+# Description
+##################################################################################
+# This module defines the root directories of the Grid-Stat outputs and of the
+# processed statistics, shared by the processing, post-processing and plotting
+# scripts of this directory. The module only imports post_processing_config, so
+# that scripts that need the paths, e.g., the plotting scripts, do not import
+# the processing routines of proc_gridstat.py at startup.
+#
+##################################################################################
+# License Statement
+##################################################################################
+#
+# Copyright 2023 CW3E, Contact Colin Grudzien cgrudzien@ucsd.edu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+#
+##################################################################################
+# Imports
+##################################################################################
+import post_processing_config as config
+
+##################################################################################
+# SET GLOBAL PARAMETERS
+##################################################################################
+# root directory for gridstat outputs
+IN_ROOT = '/cw3e/mead/projects/cwp106/scratch/' + config.CSE
+
+# root directory for processed pandas outputs
+OUT_ROOT = '/cw3e/mead/projects/cwp106/scratch/' + config.CSE
+
+##################################################################################
+# end
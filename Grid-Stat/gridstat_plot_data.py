@@ -0,0 +1,155 @@
+##################################################################################
+# Description
+##################################################################################
+# This module arranges the statistics loaded by the plotting scripts into the
+# arrays that are plotted, with vectorized reshaping of the loaded dataframes by
+# their typed keys instead of searching the dataframes for each plotted value.
+# The routines are shared by the plotting scripts and their _level variants,
+# which differ in the statistics and thresholds that are loaded only.
+#
+# Die-off curves aggregated over a window of valid dates are the means of the
+# statistics of each lead over the valid dates with data, with bootstrap
+# intervals resampling the valid dates, by the same vectorized replicates as
+# gridstat_agg.py, or normal intervals of the mean.
+#
+##################################################################################
+# License Statement
+##################################################################################
+#
+# Copyright 2023 CW3E, Contact Colin Grudzien cgrudzien@ucsd.edu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+#
+##################################################################################
+# Imports
+##################################################################################
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+from gridstat_agg import N_BOOT, BOOT_ALPHA, get_boot_counts, get_percentiles
+
+##################################################################################
+# SET GLOBAL PARAMETERS
+##################################################################################
+# seed of the bootstrap replicates of aggregated curves, so that figures are
+# reproducible
+BOOT_SEED = 0
+
+##################################################################################
+# Heat plot matrices
+##################################################################################
+# function to arrange a statistic of the loaded data by forecast lead and valid
+# date, with one pivot of the rows on the LEAD_HR and VALID_DT columns, returns
+# an array of shape (leads, valid dates) with NaN where there is no statistic,
+# where lead / valid date pairs with several rows, e.g., of duplicated stores,
+# are left missing as no single value is defined
+def get_heat_matrix(plt_data, stat, leads, valid_dts):
+    keys = ['LEAD_HR', 'VALID_DT']
+    tmp = np.full([len(leads), len(valid_dts)], np.nan)
+    if plt_data.empty or stat not in plt_data.columns or\
+            not all(key in plt_data.columns for key in keys):
+        return tmp
+
+    rows = ~plt_data.duplicated(subset=keys, keep=False).values
+    mat = plt_data.loc[rows].pivot(index='LEAD_HR', columns='VALID_DT',
+                                   values=stat)
+
+    mat = mat.reindex(index=pd.Index(leads, dtype=mat.index.dtype),
+                      columns=pd.DatetimeIndex(valid_dts))
+
+    tmp[:] = mat.values
+    return tmp
+
+# function to find the color bar scale of the inner 100 - alpha percent range
+# of the defined values of a matrix, returns the minimum and maximum of the
+# scale, or None for both if no value is defined
+def get_scale(tmp, alpha=1):
+    scale = tmp[~np.isnan(tmp)]
+    if len(scale) == 0:
+        return None, None
+
+    max_scale, min_scale = np.percentile(scale, [100 - alpha / 2, alpha / 2])
+    return min_scale, max_scale
+
+##################################################################################
+# Die-off curves
+##################################################################################
+# function to arrange statistics of the loaded data of one configuration by
+# forecast lead, with one reindex of the rows on the LEAD_HR column, where leads
+# with several rows, e.g., of several verified fields, are left missing as in
+# get_heat_matrix, returns an array of shape (stats, leads, 3) of each statistic
+# with its lower and upper confidence bounds, NaN where not defined, and a list
+# of the confidence interval suffix of each statistic, '_BC' for bootstrap
+# intervals, '_NC' for normal intervals or False for statistics without
+# intervals, where bootstrap intervals take precedence if they are defined at
+# all leads of the data
+def get_curves(data, stats, leads):
+    stats = list(stats)
+    bc = data.reindex(columns=[stat + '_BCL' for stat in stats]).notna().all()
+    nc = data.reindex(columns=[stat + '_NCL' for stat in stats]).notna().all()
+    cnf_lvs = np.where(bc.values, '_BC', np.where(nc.values, '_NC', ''))
+
+    lead_data = data.drop_duplicates('LEAD_HR', keep=False).set_index('LEAD_HR')
+    lead_data = lead_data.reindex(index=pd.Index(leads,
+                                                 dtype=lead_data.index.dtype))
+
+    tmp = np.full([len(stats), len(leads), 3], np.nan)
+    tmp[:, :, 0] = lead_data.reindex(columns=stats).values.T
+    cnf = cnf_lvs != ''
+    if cnf.any():
+        cnf_stats = [stats[i_ns] + cnf_lvs[i_ns] for i_ns in np.where(cnf)[0]]
+        tmp[cnf, :, 1] = lead_data[[stat + 'L' for stat in cnf_stats]].values.T
+        tmp[cnf, :, 2] = lead_data[[stat + 'U' for stat in cnf_stats]].values.T
+
+    return tmp, [cnf_lv if cnf_lv else False for cnf_lv in cnf_lvs]
+
+# function to aggregate statistics of the loaded data of one configuration by
+# forecast lead over the valid dates valid_dts, as the mean over the valid dates
+# with a statistic, returns an array of shape (stats, leads, 3) of the mean of
+# each statistic with its lower and upper confidence bounds as get_curves, where
+# cnf_lv is '_BC' for bootstrap intervals of n_boot replicates resampling the
+# valid dates or '_NC' for normal intervals, at significance level alpha
+def agg_curves(data, stats, leads, valid_dts, cnf_lv='_BC', n_boot=N_BOOT,
+               alpha=BOOT_ALPHA, seed=BOOT_SEED):
+    # statistics of shape (stats, leads, valid dates) with one pivot each
+    mats = np.stack([get_heat_matrix(data, stat, leads, valid_dts)
+                     for stat in stats])
+
+    dfnd = np.isfinite(mats)
+    vals = np.where(dfnd, mats, 0.0)
+    n_vals = dfnd.sum(axis=2)
+
+    tmp = np.full([len(stats), len(leads), 3], np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tmp[:, :, 0] = vals.sum(axis=2) / n_vals
+        if cnf_lv == '_BC' and len(valid_dts) > 0:
+            # replicate means as matrix products with the resampled valid
+            # dates, of shape (replicates, stats, leads)
+            counts = get_boot_counts(n_boot, len(valid_dts), seed)
+            reps = np.matmul(vals, counts.T) / np.matmul(dfnd, counts.T)
+            reps = np.moveaxis(reps, 2, 0).reshape(n_boot, -1)
+            bnds = get_percentiles(reps, [alpha / 2, 1 - alpha / 2])
+            tmp[:, :, 1:] = np.moveaxis(bnds.reshape(2, len(stats), -1), 0, 2)
+
+        elif cnf_lv == '_NC':
+            # standard errors of the means from the sample variance
+            sq_dev = np.where(dfnd, mats - tmp[:, :, [0]], 0.0)**2
+            std_err = np.sqrt(sq_dev.sum(axis=2) / (n_vals - 1) / n_vals)
+            hlf_wdth = NormalDist().inv_cdf(1 - alpha / 2) * std_err
+            tmp[:, :, 1] = tmp[:, :, 0] - hlf_wdth
+            tmp[:, :, 2] = tmp[:, :, 0] + hlf_wdth
+
+    return tmp, [cnf_lv] * len(stats)
+
+##################################################################################
+# end
@@ -0,0 +1,384 @@
+##################################################################################
+# Description
+##################################################################################
+# This module reads and writes the columnar statistics store for processed
+# Grid-Stat outputs, replacing the pickled dictionaries of dataframes in the
+# grid_stats_*.bin files. A store is a directory, named as the .bin file
+# without extension, that is partitioned into sub-directories by line type.
+# Each line type is written in one or more parts, e.g., one part per forecast
+# lead, where a part directory contains a NumPy .npy file for each column and
+# a _schema.json file with the number of rows, column order and data types of
+# the part. A _manifest.json file at the top of the store records the inputs
+# that the store was processed from. Categorical columns are stored as integer
+# codes with categories listed in the schema, so that readers can skip parts
+# that do not contain a requested value and load only the columns that are
+# needed, e.g.,
+#
+#     OUT_ROOT/NRT_gfs/2022121400/grid_stats_d01_2022121400/cnt/part-00000/RMSE.npy
+#
+# Column files are memory-mapped when read, so that only the pages of the rows
+# that are used are read from disk, without deserialization, and pages are
+# shared by concurrent readers through the page cache. Completed stores are
+# compacted into a single part per line type, such that columns read without
+# row filters are returned as views of the mapped files without copies.
+#
+# Run as a script, this module converts an existing archive of grid_stats_*.bin
+# files below OUT_ROOT into stores written next to each binary file.
+#
+##################################################################################
+# License Statement
+##################################################################################
+#
+# Copyright 2023 CW3E, Contact Colin Grudzien cgrudzien@ucsd.edu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+#
+##################################################################################
+# Imports
+##################################################################################
+import os
+import json
+import shutil
+import pickle
+import numpy as np
+import pandas as pd
+from met_line_types import apply_dtypes, add_numeric_cols, concat_typed
+
+##################################################################################
+# SET GLOBAL PARAMETERS
+##################################################################################
+# schema file name within each part directory
+SCHM_F = '_schema.json'
+
+# manifest file name within each store directory
+MNFST_F = '_manifest.json'
+
+# version of the store layout recorded in manifests, incremented when the
+# columns written at ingest change so that existing stores are re-processed,
+# version 2 adds the derived numeric columns of met_line_types.py
+STORE_VRSN = 2
+
+# mode to memory-map column files when read, None to read them into memory
+MMAP_MD = 'r'
+
+# standard string indentation
+STR_INDT = '    '
+
+##################################################################################
+# Writing routines
+##################################################################################
+# function to write a dataframe as a numbered part of a line type in the store,
+# string columns are written as categoricals
+def write_part(store_path, line_type, df, part):
+    part_dir = store_path + '/' + line_type + '/part-%05d'%part
+    os.makedirs(part_dir, exist_ok=True)
+
+    schema = {'nrows': len(df.index), 'columns': []}
+    for col in df.columns:
+        vals = df[col]
+        if vals.dtype == object:
+            vals = vals.astype('category')
+
+        if isinstance(vals.dtype, pd.CategoricalDtype):
+            np.save(part_dir + '/' + col + '.npy', vals.cat.codes.values)
+            schema['columns'].append({'name': col, 'dtype': 'category',
+                'categories': [str(cat) for cat in vals.cat.categories]})
+
+        else:
+            np.save(part_dir + '/' + col + '.npy', vals.values)
+            schema['columns'].append({'name': col, 'dtype': str(vals.dtype)})
+
+    with open(part_dir + '/' + SCHM_F, 'w') as f:
+        json.dump(schema, f)
+
+# function to write a dictionary of dataframes keyed by line type to a store,
+# the store is written in a temporary directory and then moved into place so
+# that readers never see a partially written store
+def write_store(data_dict, store_path):
+    tmp_path = store_path + '.tmp'
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+
+    os.makedirs(tmp_path)
+    for line_type in data_dict.keys():
+        write_part(tmp_path, line_type, data_dict[line_type], 0)
+
+    replace_store(tmp_path, store_path)
+
+# function to write the manifest of the inputs and outputs of a store
+def write_manifest(store_path, manifest):
+    with open(store_path + '/' + MNFST_F, 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+# function to compact the parts of each line type of a store into a single part,
+# streaming each column into a memory-mapped output file so that memory is not
+# bounded by the size of the store, where the categories of categorical columns
+# are merged in order of appearance and line types with parts of differing
+# columns or data types are left as is
+def compact_store(store_path):
+    for line_type in list_line_types(store_path):
+        schemas = read_schemas(store_path, line_type)
+        cols = [[(col['name'], col['dtype']) for col in schema['columns']]
+                for schema in schemas]
+
+        if len(schemas) < 2 or any(part_cols != cols[0] for part_cols in cols):
+            continue
+
+        nrows = sum([schema['nrows'] for schema in schemas])
+        cmpct_dir = store_path + '/_' + line_type + '/part-00000'
+        os.makedirs(cmpct_dir)
+
+        cmpct_schema = {'nrows': nrows, 'columns': []}
+        for i_nc, (col_name, col_dtype) in enumerate(cols[0]):
+            out_path = cmpct_dir + '/' + col_name + '.npy'
+            in_paths = [schema['path'] + '/' + col_name + '.npy'
+                        for schema in schemas]
+
+            if col_dtype == 'category':
+                cats = []
+                cat_indx = {}
+                for schema in schemas:
+                    for cat in schema['columns'][i_nc]['categories']:
+                        if cat not in cat_indx.keys():
+                            cat_indx[cat] = len(cats)
+                            cats.append(cat)
+
+                out_dtype = pd.Categorical.from_codes([],
+                                                      categories=cats).codes.dtype
+
+                cmpct_schema['columns'].append({'name': col_name,
+                    'dtype': 'category', 'categories': cats})
+
+            else:
+                out_dtype = np.load(in_paths[0], mmap_mode='r').dtype
+                cmpct_schema['columns'].append({'name': col_name,
+                                                'dtype': col_dtype})
+
+            out_vals = np.lib.format.open_memmap(out_path, mode='w+',
+                                                 dtype=out_dtype,
+                                                 shape=(nrows,))
+
+            i_nr = 0
+            for schema, in_path in zip(schemas, in_paths):
+                in_vals = np.load(in_path, mmap_mode='r')
+                if col_dtype == 'category':
+                    # map part codes to merged codes, where the last entry
+                    # keeps missing values coded as -1
+                    cat_map = np.array([cat_indx[cat] for cat in
+                                        schema['columns'][i_nc]['categories']] +\
+                                       [-1], dtype=out_dtype)
+
+                    in_vals = cat_map[in_vals]
+
+                out_vals[i_nr:i_nr + len(in_vals)] = in_vals
+                i_nr += len(in_vals)
+
+            out_vals.flush()
+            del out_vals
+
+        with open(cmpct_dir + '/' + SCHM_F, 'w') as f:
+            json.dump(cmpct_schema, f)
+
+        shutil.rmtree(store_path + '/' + line_type)
+        os.replace(store_path + '/_' + line_type, store_path + '/' + line_type)
+
+# function to move a temporary store into place over an existing store
+def replace_store(tmp_path, store_path):
+    if os.path.isdir(store_path):
+        shutil.rmtree(store_path)
+
+    os.replace(tmp_path, store_path)
+
+##################################################################################
+# Reading routines
+##################################################################################
+# function to list the line types written to a store
+def list_line_types(store_path):
+    return sorted([name for name in os.listdir(store_path)
+                   if not name.startswith('_')])
+
+# function to load the manifest of a store, returns None if the store or its
+# manifest does not exist
+def read_manifest(store_path):
+    mnfst_path = store_path + '/' + MNFST_F
+    if not os.path.isfile(mnfst_path):
+        return None
+
+    with open(mnfst_path) as f:
+        return json.load(f)
+
+# function to load the schemas of the parts of a line type in part order
+def read_schemas(store_path, line_type):
+    type_dir = store_path + '/' + line_type
+    schemas = []
+    for part in sorted(os.listdir(type_dir)):
+        with open(type_dir + '/' + part + '/' + SCHM_F) as f:
+            schema = json.load(f)
+
+        schema['path'] = type_dir + '/' + part
+        schemas.append(schema)
+
+    return schemas
+
+# function to list the columns of a line type in a store
+def read_columns(store_path, line_type):
+    cols = []
+    for schema in read_schemas(store_path, line_type):
+        for col in schema['columns']:
+            if col['name'] not in cols:
+                cols.append(col['name'])
+
+    return cols
+
+# function to load one column of a part as a Pandas series, memory-mapped
+# unless rows are selected, where only the selected rows are copied
+def load_column(schema, col, rows=None):
+    vals = np.load(schema['path'] + '/' + col['name'] + '.npy',
+                   mmap_mode=MMAP_MD)
+    if rows is not None:
+        vals = vals[rows]
+
+    if col['dtype'] == 'category':
+        vals = pd.Categorical.from_codes(vals, categories=col['categories'])
+
+    return pd.Series(vals, name=col['name'])
+
+# function to read a line type from a store into a dataframe indexed by 'line',
+# optionally loading only the listed columns and only the rows matching the
+# filters, a dictionary of column names to a value or list of values, where
+# parts are skipped when a filtered categorical column cannot match
+def read_stats(store_path, line_type, columns=None, filters=None):
+    if filters is None:
+        filters = {}
+
+    load_cols = columns
+    if load_cols is None:
+        load_cols = []
+
+    part_dfs = []
+    line_indx = 1
+    for schema in read_schemas(store_path, line_type):
+        part_cols = {col['name']: col for col in schema['columns']}
+        if columns is None:
+            load_cols = list(part_cols.keys())
+
+        else:
+            load_cols = columns
+
+        for col_name in list(load_cols) + list(filters.keys()):
+            if col_name not in part_cols.keys():
+                raise KeyError(col_name + ' is not a column of ' + line_type +\
+                        ' in ' + store_path)
+
+        # find the rows of the part matching all filters
+        rows = np.ones(schema['nrows'], dtype=bool)
+        for col_name, vals in filters.items():
+            if not isinstance(vals, (list, tuple, set)):
+                vals = [vals]
+
+            col = part_cols[col_name]
+            if col['dtype'] == 'category':
+                codes = [col['categories'].index(val) for val in vals
+                         if val in col['categories']]
+
+                if len(codes) == 0:
+                    rows[:] = False
+                    break
+
+                rows &= np.isin(np.load(schema['path'] + '/' + col_name +\
+                                        '.npy', mmap_mode=MMAP_MD), codes)
+
+            else:
+                rows &= np.isin(load_column(schema, col).values, list(vals))
+
+        if rows.any():
+            # columns are views of the mapped files if all rows are selected
+            if rows.all():
+                part_df = pd.concat([load_column(schema, part_cols[col_name])
+                                     for col_name in load_cols], axis=1,
+                                    copy=False)
+                part_df.index = pd.RangeIndex(line_indx, line_indx +\
+                                              schema['nrows'], name='line')
+
+            else:
+                rows = np.flatnonzero(rows)
+                part_df = pd.concat([load_column(schema, part_cols[col_name],
+                                                 rows)
+                                     for col_name in load_cols], axis=1,
+                                    copy=False)
+                part_df.index = pd.Index(rows + line_indx, name='line')
+
+            part_dfs.append(part_df)
+
+        line_indx += schema['nrows']
+
+    if len(part_dfs) == 0:
+        return pd.DataFrame(columns=load_cols,
+                            index=pd.Index([], name='line'))
+
+    elif len(part_dfs) == 1:
+        return part_dfs[0]
+
+    return concat_typed(part_dfs, axis=0)
+
+# function to read a store into a dictionary of dataframes keyed by line type,
+# matching the dictionaries formerly pickled in grid_stats_*.bin files
+def read_store(store_path, line_types=None, columns=None):
+    if line_types is None:
+        line_types = list_line_types(store_path)
+
+    data_dict = {}
+    for line_type in line_types:
+        data_dict[line_type] = read_stats(store_path, line_type,
+                                          columns=columns)
+
+    return data_dict
+
+##################################################################################
+# Conversion of pickled binary archives
+##################################################################################
+# function to convert a pickled grid_stats_*.bin file to a store written next
+# to the binary file, with the compact data types of the line type registry and
+# the derived numeric columns
+def convert_bin(in_path):
+    with open(in_path, 'rb') as f:
+        data_dict = pickle.load(f)
+
+    for line_type in data_dict.keys():
+        data_dict[line_type] = add_numeric_cols(apply_dtypes(
+                               data_dict[line_type], line_type))
+
+    store_path = in_path[:-len('.bin')]
+    write_store(data_dict, store_path)
+
+    return store_path
+
+# run lines if executed as a script
+if __name__ == '__main__':
+    from gridstat_paths import OUT_ROOT
+
+    print('Converting grid_stats_*.bin files below ' + OUT_ROOT + ':')
+    for root, dirs, fnames in os.walk(OUT_ROOT):
+        for fname in sorted(fnames):
+            if fname.startswith('grid_stats') and fname.endswith('.bin'):
+                in_path = root + '/' + fname
+                try:
+                    store_path = convert_bin(in_path)
+                    print(STR_INDT + in_path + ' -> ' + store_path)
+
+                except Exception as err:
+                    print('WARNING: file ' + in_path + ' could not be ' +\
+                            'converted, skipping this file: ' + str(err))
+
+##################################################################################
+# end
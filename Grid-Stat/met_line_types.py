@@ -0,0 +1,307 @@
+##################################################################################
+# Description
+##################################################################################
+# This module defines a registry of the MET Grid-Stat line types emitted by this
+# workflow, with the column layout of each line type and the compact data types
+# that are applied to these columns when Grid-Stat outputs are parsed. Header
+# columns of repeated strings are stored as Pandas categoricals, counts as 32 bit
+# integers and statistics, including normal and bootstrap confidence intervals,
+# as 32 bit floats, where partial sums are kept as 64 bit floats for exact
+# aggregation. Column layouts follow the MET version 10.0 output tables.
+#
+# Numeric columns derived from the header strings are added to every line type
+# at ingest, so that readers filter and sort on leads, dates and thresholds
+# without parsing strings:
+#
+#     LEAD_HR    - forecast lead in whole hours from FCST_LEAD, as 32 bit integers
+#     VALID_DT   - forecast valid time from FCST_VALID_END, as datetime64
+#     INIT_DT    - forecast initialization time, VALID_DT minus FCST_LEAD
+#     THRESH_OP  - operator of FCST_THRESH in symbol form, e.g., '>=', categorical
+#     THRESH_VAL - value of FCST_THRESH as 32 bit floats
+#
+# where thresholds that are not a single operator and value, e.g., 'NA' or
+# compound thresholds, have a missing operator and value.
+#
+##################################################################################
+# License Statement
+##################################################################################
+#
+# Copyright 2023 CW3E, Contact Colin Grudzien cgrudzien@ucsd.edu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+#
+##################################################################################
+# Imports
+##################################################################################
+import re
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+##################################################################################
+# Line type column definitions
+##################################################################################
+# header columns shared by all line types
+HDR_COLS = [
+            'VERSION',
+            'MODEL',
+            'DESC',
+            'FCST_LEAD',
+            'FCST_VALID_BEG',
+            'FCST_VALID_END',
+            'OBS_LEAD',
+            'OBS_VALID_BEG',
+            'OBS_VALID_END',
+            'FCST_VAR',
+            'FCST_UNITS',
+            'FCST_LEV',
+            'OBS_VAR',
+            'OBS_UNITS',
+            'OBS_LEV',
+            'OBTYPE',
+            'VX_MASK',
+            'INTERP_MTHD',
+            'INTERP_PNTS',
+            'FCST_THRESH',
+            'OBS_THRESH',
+            'COV_THRESH',
+            'ALPHA',
+            'LINE_TYPE',
+           ]
+
+# contingency table counts, shared by ctc and nbrctc
+CTC_COLS = [
+            'TOTAL',
+            'FY_OY',
+            'FY_ON',
+            'FN_OY',
+            'FN_ON',
+           ]
+
+# contingency table statistics, shared by cts and nbrcts, where statistics
+# without normal confidence intervals only include bootstrap bounds
+CTS_COLS = ['TOTAL']
+for stat in ['BASER', 'FMEAN', 'ACC', 'FBIAS', 'PODY', 'PODN', 'POFD', 'FAR',
+             'CSI', 'GSS', 'HK', 'HSS', 'ODDS', 'LODDS', 'ORSS', 'EDS', 'SEDS',
+             'EDI', 'SEDI', 'BAGSS']:
+    CTS_COLS.append(stat)
+    if stat not in ['FBIAS', 'GSS', 'HSS', 'BAGSS']:
+        CTS_COLS += [stat + '_NCL', stat + '_NCU']
+
+    CTS_COLS += [stat + '_BCL', stat + '_BCU']
+
+# continuous statistics
+CNT_COLS = ['TOTAL']
+for stat in ['FBAR', 'FSTDEV', 'OBAR', 'OSTDEV', 'PR_CORR']:
+    CNT_COLS += [stat, stat + '_NCL', stat + '_NCU', stat + '_BCL', stat + '_BCU']
+
+CNT_COLS += ['SP_CORR', 'KT_CORR', 'RANKS', 'FRANK_TIES', 'ORANK_TIES']
+for stat in ['ME', 'ESTDEV']:
+    CNT_COLS += [stat, stat + '_NCL', stat + '_NCU', stat + '_BCL', stat + '_BCU']
+
+for stat in ['MBIAS', 'MAE', 'MSE', 'BCMSE', 'RMSE', 'E10', 'E25', 'E50', 'E75',
+             'E90', 'EIQR', 'MAD']:
+    CNT_COLS += [stat, stat + '_BCL', stat + '_BCU']
+
+CNT_COLS += ['ANOM_CORR', 'ANOM_CORR_NCL', 'ANOM_CORR_NCU', 'ANOM_CORR_BCL',
+             'ANOM_CORR_BCU']
+for stat in ['ME2', 'MSESS', 'RMSFA', 'RMSOA', 'ANOM_CORR_UNCNTR']:
+    CNT_COLS += [stat, stat + '_BCL', stat + '_BCU']
+
+# neighborhood continuous statistics
+NBRCNT_COLS = ['TOTAL']
+for stat in ['FBS', 'FSS', 'AFSS', 'UFSS', 'F_RATE', 'O_RATE']:
+    NBRCNT_COLS += [stat, stat + '_BCL', stat + '_BCU']
+
+# scalar partial sums of continuous statistics
+SL1L2_COLS = [
+              'TOTAL',
+              'FBAR',
+              'OBAR',
+              'FOBAR',
+              'FFBAR',
+              'OOBAR',
+              'MAE',
+             ]
+
+# registry of line type specific columns, keyed by the lower case file
+# extensions of grid_stat_*.txt outputs
+LINE_TYPES = {
+              'fho': ['TOTAL', 'F_RATE', 'H_RATE', 'O_RATE'],
+              'ctc': CTC_COLS,
+              'cts': CTS_COLS,
+              'cnt': CNT_COLS,
+              'sl1l2': SL1L2_COLS,
+              'nbrctc': CTC_COLS,
+              'nbrcts': CTS_COLS,
+              'nbrcnt': NBRCNT_COLS,
+             }
+
+##################################################################################
+# Compact data types
+##################################################################################
+# header columns of repeated strings stored as categoricals
+CAT_COLS = [col for col in HDR_COLS if col not in ['INTERP_PNTS', 'ALPHA']]
+
+# integer valued columns, all other registered columns are statistics
+INT_COLS = [
+            'INTERP_PNTS',
+            'TOTAL',
+            'FY_OY',
+            'FY_ON',
+            'FN_OY',
+            'FN_ON',
+            'RANKS',
+            'FRANK_TIES',
+            'ORANK_TIES',
+           ]
+
+# line types of partial sums, differenced when statistics are aggregated, whose
+# non-integer columns are kept at double precision
+F64_TYPES = ['sl1l2']
+
+# function to define the data types for the columns of a line type, columns
+# are kept as strings for line types that are not in the registry
+def get_dtypes(line_type, cols):
+    if line_type not in LINE_TYPES.keys():
+        return str
+
+    dtypes = {}
+    for col in cols:
+        if col in CAT_COLS:
+            dtypes[col] = 'category'
+
+        elif col in INT_COLS:
+            dtypes[col] = 'int32'
+
+        elif line_type in F64_TYPES:
+            dtypes[col] = 'float64'
+
+        else:
+            dtypes[col] = 'float32'
+
+    return dtypes
+
+# function to cast the string columns of a parsed dataframe to the data types
+# of the line type registry, e.g., for dataframes pickled before the registry
+def apply_dtypes(df, line_type):
+    dtypes = get_dtypes(line_type, df.columns)
+    if dtypes is str:
+        return df
+
+    df = df.copy()
+    for col, dtype in dtypes.items():
+        if dtype == 'category':
+            df[col] = df[col].astype('category')
+
+        else:
+            df[col] = pd.to_numeric(df[col]).astype(dtype)
+
+    return df
+
+##################################################################################
+# Derived numeric columns
+##################################################################################
+# numeric columns derived from header strings at ingest
+NUM_COLS = ['LEAD_HR', 'VALID_DT', 'INIT_DT', 'THRESH_OP', 'THRESH_VAL']
+
+# MET threshold operator abbreviations and their symbol forms
+THRESH_OPS = {
+              'lt': '<',
+              'le': '<=',
+              'eq': '==',
+              'ne': '!=',
+              'gt': '>',
+              'ge': '>=',
+             }
+
+# pattern of a single threshold, an operator followed by a numeric value
+THRESH_PTRN = re.compile(r'^(<=|>=|==|!=|<|>|lt|le|eq|ne|gt|ge)' +\
+                         r'([-+]?[0-9.]+(?:[eE][-+]?[0-9]+)?)$')
+
+# function to parse a FCST_THRESH string into its operator in symbol form and
+# value, returns missing values for thresholds that are not a single operator
+def parse_thresh(thresh):
+    match = THRESH_PTRN.match(str(thresh))
+    if match is None:
+        return np.nan, np.nan
+
+    op, val = match.groups()
+    return THRESH_OPS.get(op, op), float(val)
+
+# function to map a function of the unique values of a column to all rows, where
+# the function is evaluated once per category and missing values map to fill
+def map_categories(vals, func, fill):
+    vals = vals.astype('category')
+    codes = vals.cat.codes.values
+    mapped = np.asarray(func(vals.cat.categories))
+    if len(mapped) == 0:
+        return np.full(len(codes), fill)
+
+    mapped = mapped[codes]
+    if (codes == -1).any():
+        mapped = np.where(codes == -1, fill, mapped)
+
+    return mapped
+
+# function to add the numeric lead, valid time, initialization time and
+# threshold columns derived from the header strings of a parsed dataframe
+def add_numeric_cols(df):
+    # non left-padded HHMMSS leads, parsed as seconds
+    lead_s = map_categories(df['FCST_LEAD'], lambda cats:
+            [int(cat[:-4] or 0) * 3600 + int(cat[-4:-2] or 0) * 60 +\
+             int(cat[-2:]) for cat in cats], 0).astype('int64')
+
+    valid_dt = map_categories(df['FCST_VALID_END'], lambda cats:
+            pd.to_datetime(cats, format='%Y%m%d_%H%M%S', errors='coerce'),
+            np.datetime64('NaT')).astype('datetime64[ns]')
+
+    thresh_op = map_categories(df['FCST_THRESH'], lambda cats:
+            [parse_thresh(cat)[0] for cat in cats], np.nan)
+
+    thresh_val = map_categories(df['FCST_THRESH'], lambda cats:
+            [parse_thresh(cat)[1] for cat in cats], np.nan).astype('float32')
+
+    return df.assign(
+                     LEAD_HR=(lead_s // 3600).astype('int32'),
+                     VALID_DT=valid_dt,
+                     INIT_DT=valid_dt - lead_s.astype('timedelta64[s]'),
+                     THRESH_OP=pd.Categorical(thresh_op,
+                             categories=sorted(THRESH_OPS.values())),
+                     THRESH_VAL=thresh_val,
+                    )
+
+# function to concatenate typed dataframes, taking the union of the categories
+# of categorical columns so that these are not cast back to object strings
+def concat_typed(dfs, **kwargs):
+    dfs = [df for df in dfs if df is not None]
+    cat_cols = []
+    for df in dfs:
+        for col in df.columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype) and\
+                    col not in cat_cols:
+                cat_cols.append(col)
+
+    for col in cat_cols:
+        vals = [df[col] for df in dfs if col in df.columns]
+        if all(isinstance(val.dtype, pd.CategoricalDtype) for val in vals):
+            cats = union_categoricals(vals, ignore_order=True).categories
+            for i_df in range(len(dfs)):
+                if col in dfs[i_df].columns:
+                    dfs[i_df] = dfs[i_df].assign(**{col:
+                                dfs[i_df][col].cat.set_categories(cats)})
+
+    return pd.concat(dfs, **kwargs)
+
+##################################################################################
+# end
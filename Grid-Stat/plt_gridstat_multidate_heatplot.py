@@ -36,17 +36,24 @@ import matplotlib
 matplotlib.use('AGG')
 from datetime import datetime as dt
 import matplotlib.pyplot as plt
-from matplotlib.colors import Normalize as nrm
-from matplotlib.cm import get_cmap
-from matplotlib.colorbar import Colorbar as cb
 import seaborn as sns
 import numpy as np
 import pandas as pd
-import pickle
-import os
 import sys
 import post_processing_config as config
-from proc_gridstat import OUT_ROOT
+from gridstat_paths import OUT_ROOT
+from gridstat_plot_data import get_heat_matrix, get_scale
+# import the routines of the configured source of the statistics only
+if config.USE_CUBE:
+    from gridstat_cube import NA_LAB, VAR_DIMS, read_cube, select_cube,\
+            merge_dims, defined_labels, lead_valid
+
+elif config.USE_DB:
+    from gridstat_db import DB_F, query_stats
+
+else:
+    from gridstat_loader import get_index, load_stats
+    from gridstat_index import has_path
 
 ##################################################################################
 # SET GLOBAL PARAMETERS 
@@ -169,56 +176,94 @@ fcst_leads = []
 anl_dates = pd.date_range(start=anl_strt, end=anl_end,
                           freq=anl_int).to_pydatetime()
 
-data_root = OUT_ROOT + '/' + config.CTR_FLW
-plt_data = pd.DataFrame()
-for fcst_zh in fcst_zhs:
-    # define the input name
-    zh_strng = fcst_zh.strftime('%Y%m%d%H')
-    in_path = data_root + '/' + zh_strng + '/grid_stats' + pfx + grd +\
-              '_' + zh_strng + '.bin'
-    
+# load the values to be plotted along with landmask and lead
+vals = [
+        'VX_MASK',
+        'LEAD_HR',
+        'VALID_DT',
+       ]
+
+# include the statistics and their confidence intervals
+vals += [STAT]
+
+if config.USE_CUBE:
+    # select the slice of all cycles at once from the statistics cube, where
+    # statistics that are not leveled have the threshold label NA_LAB
+    try:
+        cube, crds = read_cube(OUT_ROOT, TYPE)
+        cube_data, cube_crds = select_cube(cube, crds, CTR_FLW=config.CTR_FLW,
+                GRD=config.GRD, PRFX=config.PRFX, VX_MASK=config.LND_MSK,
+                FCST_THRESH=NA_LAB, INIT=fcst_zhs)
+
+        # obtain leads with any statistic in any cycle, as the leads of the
+        # rows loaded from the stores
+        fcst_leads = defined_labels(cube_data, cube_crds, 'LEAD_HR')
+
+        # merge the verified fields, where cells of several fields are NaN
+        cube_data, cube_crds = merge_dims(*select_cube(cube_data, cube_crds,
+                STAT=STAT), VAR_DIMS)
+
+    except:
+        print('WARNING: statistics ' + TYPE + ' do not exist in the cube of ' +\
+                OUT_ROOT + ', skipping this configuration.')
+        cube_data, cube_crds = np.empty([0, 0]), {'INIT': [], 'LEAD_HR': []}
+        fcst_leads = []
+
+elif config.USE_DB:
+    # query the slice of all cycles at once from the statistics database
     try:
-        with open(in_path, 'rb') as f:
-            data = pickle.load(f)
-            data = data[TYPE]
+        plt_data = query_stats(OUT_ROOT + '/' + DB_F, TYPE, columns=vals,
+                filters={'CTR_FLW': config.CTR_FLW, 'GRD': config.GRD,
+                         'PRFX': config.PRFX, 'VX_MASK': config.LND_MSK,
+                         'CYCLE': [fcst_zh.strftime('%Y%m%d%H') for
+                                   fcst_zh in fcst_zhs]})
 
     except:
-        print('WARNING: input data ' + in_path + ' statistics ' + TYPE +\
-                ' does not exist, skipping this configuration.')
-        continue
-
-    # load the values to be plotted along with landmask and lead
-    vals = [
-            'VX_MASK',
-            'FCST_LEAD',
-            'FCST_VALID_END',
-           ]
-
-    # include the statistics and their confidence intervals
-    vals += [STAT]
+        print('WARNING: statistics ' + TYPE + ' do not exist in ' + OUT_ROOT +\
+                '/' + DB_F + ', skipping this configuration.')
+        plt_data = pd.DataFrame(columns=vals)
+
+    fcst_leads = list(np.unique(plt_data['LEAD_HR']))
+
+else:
+    # index the statistics stores below OUT_ROOT in one scan
+    index = get_index(OUT_ROOT)
+
+    data_root = OUT_ROOT + '/' + config.CTR_FLW
+    plt_data = pd.DataFrame()
+    for fcst_zh in fcst_zhs:
+        # define the input name
+        zh_strng = fcst_zh.strftime('%Y%m%d%H')
+        in_path = data_root + '/' + zh_strng + '/grid_stats' + pfx + grd +\
+                  '_' + zh_strng
+
+        # skip cycles without a statistics store in the index
+        if not has_path(index, in_path):
+            print('WARNING: input data ' + in_path + ' does not exist,' +\
+                    ' skipping this configuration.')
+            continue
     
-    # cut down df to specified region / relevant stats
-    stat_data = data[vals]
-    stat_data = stat_data.loc[(stat_data['VX_MASK'] == config.LND_MSK)]
+        # load only the relevant stats for the specified region
+        try:
+            stat_data = load_stats(in_path, TYPE, columns=vals,
+                                   filters={'VX_MASK': config.LND_MSK})
 
-    # check if there is data for this configuration and these fields
-    if not stat_data.empty:
-        plt_data = pd.concat([plt_data, stat_data], axis=0)
+        except:
+            print('WARNING: input data ' + in_path + ' statistics ' + TYPE +\
+                    ' does not exist, skipping this configuration.')
+            continue
+
+        # check if there is data for this configuration and these fields
+        if not stat_data.empty:
+            plt_data = pd.concat([plt_data, stat_data], axis=0)
 
-        # obtain leads of data 
-        leads = sorted(list(set(stat_data['FCST_LEAD'].values)),
-                       key=lambda x:(len(x), x))
-        fcst_leads += leads
+            # obtain leads of data 
+            leads = list(np.unique(stat_data['LEAD_HR']))
+            fcst_leads += leads
 
 # find all unique values for forecast leads, sorted for plotting, less than max lead
-fcst_leads = sorted(list(set(fcst_leads)), key=lambda x:(len(x), x))
-i_fl = 0
-while i_fl < len(fcst_leads):
-    ld = fcst_leads[i_fl][:-4]
-    if int(ld) > int(config.MAX_LD):
-        del fcst_leads[i_fl]
-    else:
-        i_fl += 1
+fcst_leads = np.unique(fcst_leads).astype(int)
+fcst_leads = list(fcst_leads[fcst_leads <= int(config.MAX_LD)])
 
 ##################################################################################
 # Begin plotting
@@ -232,40 +277,30 @@ ax1 = fig.add_axes([.07, .18, .84, .77])
 
 num_leads = len(fcst_leads)
 num_dates = len(anl_dates)
-
-# create array storage for stats
-tmp = np.empty([num_leads, num_dates])
-tmp[:] = np.nan
 fcst_dates = []
 
 # reverse order for plotting
 fcst_leads = fcst_leads[::-1]
 
 for i_nd in range(num_dates):
-    for i_nl in range(num_leads):
-        if i_nl == 0:
-            # on the first loop pack the tick labels
-            if ( i_nd % 2 ) == 0 or num_dates < 10:
-              # if 10 or more leads, only use every other as a label
-              fcst_dates.append(anl_dates[i_nd].strftime('%Y%m%d'))
-            else:
-                fcst_dates.append('')
+    # pack the tick labels
+    if ( i_nd % 2 ) == 0 or num_dates < 10:
+      # if 10 or more leads, only use every other as a label
+      fcst_dates.append(anl_dates[i_nd].strftime('%Y%m%d'))
+    else:
+        fcst_dates.append('')
 
-        try:
-            val = plt_data.loc[(plt_data['FCST_LEAD'] == fcst_leads[i_nl]) &
-                                (plt_data['FCST_VALID_END'] == anl_dates[i_nd].strftime('%Y%m%d_%H%M%S'))]
-            
-            if not val.empty:
-                tmp[i_nl, i_nd] = val[STAT]
+if config.USE_CUBE:
+    # arrange the cube slice by lead and valid date
+    tmp = lead_valid(cube_data, cube_crds, fcst_leads, anl_dates)
 
-        except:
-            continue
+else:
+    # arrange the statistics by lead and valid date with one pivot
+    tmp = get_heat_matrix(plt_data, STAT, fcst_leads, anl_dates)
 
 if config.DYN_SCL:
     # find the max / min value over the inner 100 - alpha range of the data
-    scale = tmp[~np.isnan(tmp)]
-    alpha = 1
-    max_scale, min_scale = np.percentile(scale, [100 - alpha / 2, alpha / 2])
+    min_scale, max_scale = get_scale(tmp, alpha=1)
 
 else:
     # min scale and max scale are set in the above
@@ -278,10 +313,6 @@ sns.heatmap(tmp[:,:], linewidth=0.5, ax=ax1, cbar_ax=ax0, vmin=min_scale,
 ##################################################################################
 # define display parameters
 
-# generate tic labels based on hour values
-for i in range(num_leads):
-    fcst_leads[i] = fcst_leads[i][:-4]
-
 ax0.set_yticklabels(ax0.get_yticklabels(), rotation=270, va='top')
 ax1.set_xticklabels(fcst_dates, rotation=45, ha='right')
 ax1.set_yticklabels(fcst_leads)
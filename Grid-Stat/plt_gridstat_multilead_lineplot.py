@@ -36,17 +36,25 @@ import matplotlib
 matplotlib.use('AGG')
 from datetime import datetime as dt
 import matplotlib.pyplot as plt
-from matplotlib.colors import Normalize as nrm
-from matplotlib.cm import get_cmap
-from matplotlib.colorbar import Colorbar as cb
 import seaborn as sns
 import numpy as np
 import pandas as pd
-import pickle
 import os
 import sys
 import post_processing_config as config
-from proc_gridstat import OUT_ROOT
+from gridstat_paths import OUT_ROOT
+from gridstat_plot_data import get_curves, agg_curves
+# import the routines of the configured source of the statistics only
+if config.USE_CUBE:
+    from gridstat_cube import NA_LAB, VAR_DIMS, read_cube, select_cube,\
+            merge_dims, lead_valid
+
+elif config.USE_DB:
+    from gridstat_db import DB_F, query_columns, query_stats
+
+else:
+    from gridstat_loader import get_index, load_columns, load_stats
+    from gridstat_index import has_path
 
 ##################################################################################
 # SET GLOBAL PARAMETERS 
@@ -62,6 +70,19 @@ STATS = ['RMSE', 'PR_CORR']
 TITLE='24hr accumulated precip at ' + config.VALID_DT[:4] + '-' + config.VALID_DT[4:6] + '-' +\
         config.VALID_DT[6:8] + '_' + config.VALID_DT[8:]
 
+# label of the valid dates in the figure name
+vld_lab = config.VALID_DT
+
+# plot title of the means over the valid dates of the analysis
+if config.AGG_VLD:
+    TITLE='Mean 24hr accumulated precip ' + config.ANL_STRT[:4] + '-' +\
+            config.ANL_STRT[4:6] + '-' + config.ANL_STRT[6:8] + '_' +\
+            config.ANL_STRT[8:] + ' to ' + config.ANL_END[:4] + '-' +\
+            config.ANL_END[4:6] + '-' + config.ANL_END[6:8] + '_' +\
+            config.ANL_END[8:]
+
+    vld_lab = config.ANL_STRT + '_' + config.ANL_END + '_mean'
+
 # plot sub-title title
 SUBTITLE='Verification region -'
 lnd_msk_split = config.LND_MSK.split('_')
@@ -75,7 +96,7 @@ else:
     fig_lab = ''
 
 OUT_DIR = OUT_ROOT + '/figures' + config.FIG_CSE
-OUT_PATH = OUT_DIR + '/' + config.VALID_DT + '_' + config.LND_MSK + '_' + STATS[0] + '_' +\
+OUT_PATH = OUT_DIR + '/' + vld_lab + '_' + config.LND_MSK + '_' + STATS[0] + '_' +\
            STATS[1] + fig_lab + '_lineplot.png'
 
 ##################################################################################
@@ -111,11 +132,63 @@ if len(config.CYC_INT) != 2:
 else:
     cyc_int = config.CYC_INT + 'H'
 
+# valid dates of the lineplots, all valid dates of the analysis if aggregated
+valid_dts = [valid_dt]
+if config.AGG_VLD:
+    if len(config.ANL_STRT) != 10:
+        print('ERROR: ANL_STRT, ' + config.ANL_STRT + ', is not in YYYYMMDDHH format.')
+        sys.exit(1)
+    else:
+        as_iso = config.ANL_STRT[:4] + '-' + config.ANL_STRT[4:6] + '-' +\
+                config.ANL_STRT[6:8] + '_' + config.ANL_STRT[8:]
+        anl_strt = dt.fromisoformat(as_iso)
+
+    if len(config.ANL_END) != 10:
+        print('ERROR: ANL_END, ' + config.ANL_END + ', is not in YYYYMMDDHH format.')
+        sys.exit(1)
+    else:
+        ae_iso = config.ANL_END[:4] + '-' + config.ANL_END[4:6] + '-' +\
+                config.ANL_END[6:8] + '_' + config.ANL_END[8:]
+        anl_end = dt.fromisoformat(ae_iso)
+
+    if len(config.ANL_INT) != 2:
+        print('ERROR: ANL_INT, ' + config.ANL_INT + ', is not in HH format.')
+        sys.exit(1)
+    else:
+        anl_int = config.ANL_INT + 'H'
+
+    if config.AGG_CNF not in ['BC', 'NC']:
+        print('ERROR: AGG_CNF, ' + config.AGG_CNF + ', is not BC or NC.')
+        sys.exit(1)
+
+    valid_dts = pd.date_range(start=anl_strt, end=anl_end,
+                              freq=anl_int).to_pydatetime()
+
 # generate the date range and forecast leads for the analysis, parse binary files
 # for relevant fields
 plt_data = {}
 fcst_zhs = pd.date_range(start=strt_dt, end=end_dt, freq=cyc_int).to_pydatetime()
 
+# read from the statistics cube, the statistics database or from the statistics
+# stores of each cycle
+if config.USE_CUBE:
+    try:
+        cube, crds = read_cube(OUT_ROOT, TYPE)
+
+    except:
+        print('WARNING: statistics ' + TYPE + ' do not exist in the cube of ' +\
+                OUT_ROOT + ', skipping all configurations.')
+        cube, crds = None, None
+
+elif config.USE_DB:
+    read_cols, read_data = query_columns, query_stats
+
+else:
+    read_cols, read_data = load_columns, load_stats
+
+    # index the statistics stores below OUT_ROOT in one scan
+    index = get_index(OUT_ROOT)
+
 fcst_leads = []
 for ctr_flw in config.CTR_FLWS:
     # define derived data paths 
@@ -157,16 +230,76 @@ for ctr_flw in config.CTR_FLWS:
                     line_lab += grd
 
             key = ctr_flw + pfx + grd
-            for fcst_zh in fcst_zhs:
-                # define the input name
-                zh_strng = fcst_zh.strftime('%Y%m%d%H')
-                in_path = data_root + '/' + zh_strng + '/grid_stats' + pfx + grd +\
-                          '_' + zh_strng + '.bin'
-                
+            if config.USE_CUBE:
+                in_paths = []
                 try:
-                    with open(in_path, 'rb') as f:
-                        data = pickle.load(f)
-                        data = data[TYPE]
+                    # select the statistics of all cycles at once from the
+                    # cube, where statistics that are not leveled have the
+                    # threshold label NA_LAB
+                    cube_stats = [stat + cnf for stat in STATS for cnf in
+                                  ['', '_BCL', '_BCU', '_NCL', '_NCU']
+                                  if stat + cnf in crds['STAT']]
+                    cube_data, cube_crds = select_cube(cube, crds,
+                            CTR_FLW=ctr_flw, GRD=grid, PRFX=prfx,
+                            VX_MASK=config.LND_MSK, FCST_THRESH=NA_LAB,
+                            INIT=fcst_zhs, STAT=cube_stats)
+
+                    # merge the verified fields, where cells of several fields
+                    # are NaN
+                    cube_data, cube_crds = merge_dims(cube_data, cube_crds,
+                                                      VAR_DIMS)
+
+                except:
+                    print('WARNING: statistics ' + TYPE + ' of ' + key +\
+                            ' do not exist in the cube, skipping this ' +\
+                            'configuration.')
+                    continue
+
+                # arrange the statistics by lead and valid date
+                cube_vals = lead_valid(cube_data, cube_crds,
+                                       cube_crds['LEAD_HR'], valid_dts)
+
+                n_ld, n_vd = cube_vals.shape[:2]
+                stat_data = pd.DataFrame(cube_vals.reshape(n_ld * n_vd, -1),
+                                         columns=cube_crds['STAT'])
+
+                stat_data.insert(0, 'VALID_DT', np.tile(np.array(valid_dts,
+                        dtype='datetime64[ns]'), n_ld))
+                stat_data.insert(0, 'LEAD_HR', np.repeat(
+                        np.array(cube_crds['LEAD_HR'], dtype=int), n_vd))
+                stat_data = stat_data[stat_data[cube_stats].notna().any(axis=1)]
+                if not stat_data.empty:
+                    plt_data[key] = stat_data
+                    fcst_leads += list(stat_data['LEAD_HR'])
+
+            elif config.USE_DB:
+                # query the slice of all cycles at once from the database
+                in_paths = [OUT_ROOT + '/' + DB_F]
+                in_fltrs = {'CTR_FLW': ctr_flw, 'GRD': grid, 'PRFX': prfx,
+                            'CYCLE': [fcst_zh.strftime('%Y%m%d%H') for
+                                      fcst_zh in fcst_zhs]}
+
+            else:
+                in_paths = []
+                in_fltrs = {}
+                for fcst_zh in fcst_zhs:
+                    # define the input name
+                    zh_strng = fcst_zh.strftime('%Y%m%d%H')
+                    in_path = data_root + '/' + zh_strng + '/grid_stats' +\
+                              pfx + grd + '_' + zh_strng
+
+                    # skip cycles without a statistics store in the index
+                    if not has_path(index, in_path):
+                        print('WARNING: input data ' + in_path + ' does not ' +\
+                                'exist, skipping this configuration.')
+                        continue
+
+                    in_paths.append(in_path)
+
+            for in_path in in_paths:
+                try:
+                    # load the column names of the stored statistics
+                    cols = read_cols(in_path, TYPE)
 
                 except:
                     print('WARNING: input data ' + in_path + ' statistics ' + TYPE +\
@@ -176,32 +309,31 @@ for ctr_flw in config.CTR_FLWS:
                 # load the values to be plotted along with landmask and lead
                 vals = [
                         'VX_MASK',
-                        'FCST_LEAD',
-                        'FCST_VALID_END',
+                        'LEAD_HR',
+                        'VALID_DT',
                        ]
 
                 # include the statistics and their confidence intervals
                 vals += STATS
                 for i_ns in range(2):
                     stat = STATS[i_ns]
-                    if stat + '_BCL' in data:
+                    if stat + '_BCL' in cols:
                         vals.append(stat + '_BCL')
                         vals.append(stat + '_BCU')
     
-                    if stat + '_NCL' in data:
+                    if stat + '_NCL' in cols:
                         vals.append(stat + '_NCL')
                         vals.append(stat + '_NCU')
                 
-                # cut down df to specified valid date / region / relevant stats
-                stat_data = data[vals]
-                stat_data = stat_data.loc[(stat_data['VX_MASK'] == config.LND_MSK)]
-                stat_data = stat_data.loc[(stat_data['FCST_VALID_END'] ==
-                                           valid_dt.strftime('%Y%m%d_%H%M%S'))]
+                # load only the relevant stats for the specified valid dates / region
+                stat_data = read_data(in_path, TYPE, columns=vals,
+                        filters={**in_fltrs, 'VX_MASK': config.LND_MSK,
+                                 'VALID_DT': [np.datetime64(vld_dt)
+                                              for vld_dt in valid_dts]})
 
                 # check if there is data for this configuration and these fields
                 if not stat_data.empty:
-                    leads = sorted(list(set(stat_data['FCST_LEAD'].values)),
-                                   key=lambda x:(len(x), x))
+                    leads = list(np.unique(stat_data['LEAD_HR']))
     
                     if key in plt_data.keys():
                         # if there is existing data, concatenate dataframes
@@ -215,14 +347,8 @@ for ctr_flw in config.CTR_FLWS:
                     fcst_leads += leads
 
 # find all unique values for forecast leads, sorted for plotting, less than max lead
-fcst_leads = sorted(list(set(fcst_leads)), key=lambda x:(len(x), x))
-i_fl = 0
-while i_fl < len(fcst_leads):
-    ld = fcst_leads[i_fl][:-4]
-    if int(ld) > int(config.MAX_LD):
-        del fcst_leads[i_fl]
-    else:
-        i_fl += 1
+fcst_leads = np.unique(fcst_leads).astype(int)
+fcst_leads = list(fcst_leads[fcst_leads <= int(config.MAX_LD)])
 
 num_leads = len(fcst_leads)
 
@@ -238,8 +364,8 @@ ax1 = fig.add_axes([.110, .065, .85, .33])
 
 line_list = []
 line_labs = []
-ax0_l = []
-ax1_l = []
+axs = [ax0, ax1]
+axs_l = [[], []]
 
 stat0 = STATS[0]
 stat1 = STATS[1]
@@ -268,15 +394,15 @@ for ctr_flw in config.CTR_FLWS:
             # create label based on configuration
             split_string = ctr_flw.split('_')
             split_len = len(split_string)
-            idx_len = len(LAB_IDX)
+            idx_len = len(config.LAB_IDX)
             line_lab = ''
             lab_len = min(idx_len, split_len)
             if lab_len > 1:
                 for i_ll in range(lab_len, 1, -1):
-                    i_li = LAB_IDX[-i_ll]
+                    i_li = config.LAB_IDX[-i_ll]
                     line_lab += split_string[i_li] + '_'
     
-                i_li = LAB_IDX[-1]
+                i_li = config.LAB_IDX[-1]
                 line_lab += split_string[i_li]
     
             else:
@@ -285,52 +411,30 @@ for ctr_flw in config.CTR_FLWS:
             if pfx:
                 line_lab += pfx
     
-            if GRD_LAB:
-                    line_lab += grd
+            if config.GRD_LAB:
+                line_lab += grd
+
+            # arrange the statistics and confidence intervals by lead, with
+            # precedence for bootstrap intervals, or their means over the
+            # valid dates with the intervals of AGG_CNF
+            if config.AGG_VLD:
+                tmp, cnf_lvs = agg_curves(data, STATS, fcst_leads, valid_dts,
+                                          cnf_lv='_' + config.AGG_CNF)
 
-            # infer existence of confidence interval data with precedence for bootstrap
-            cnf_lvs = []
+            else:
+                tmp, cnf_lvs = get_curves(data, STATS, fcst_leads)
             for i_ns in range(2):
-                stat = STATS[i_ns]
-                if stat + '_BCL' in data and\
-                    not (data[stat + '_BCL'].isnull().values.any()):
-                        cnf_lvs.append('_BC')
-    
-                elif stat + '_NCL' in data and\
-                    not (data[stat + '_NCL'].isnull().values.any()):
-                        cnf_lvs.append('_NC')
-    
-                else:
-                    cnf_lvs.append(False)
-    
-                exec('ax = ax%s'%i_ns)
+                ax = axs[i_ns]
                 if cnf_lvs[i_ns]:
-                    tmp = np.empty([num_leads, 3])
-                    tmp[:] = np.nan
-            
-                    for i_nl in range(num_leads):
-                        val = data.loc[(data['FCST_LEAD'] == fcst_leads[i_nl])]
-                        if not val.empty:
-                            tmp[i_nl, 0] = val[STATS[i_ns]]
-                            tmp[i_nl, 1] = val[STATS[i_ns] + cnf_lvs[i_ns] + 'L']
-                            tmp[i_nl, 2] = val[STATS[i_ns] + cnf_lvs[i_ns] + 'U']
-                    
-                    l0 = ax.fill_between(range(num_leads), tmp[:, 1], tmp[:, 2], alpha=0.5)
-                    l1, = ax.plot(range(num_leads), tmp[:, 0], linewidth=2)
-                    exec('ax%s_l.append([l1,l0])'%i_ns)
+                    l0 = ax.fill_between(range(num_leads), tmp[i_ns, :, 1],
+                                         tmp[i_ns, :, 2], alpha=0.5)
+                    l1, = ax.plot(range(num_leads), tmp[i_ns, :, 0], linewidth=2)
+                    axs_l[i_ns].append([l1,l0])
                     l = l1
     
                 else:
-                    tmp = np.empty([num_leads])
-                    tmp[:] = np.nan
-                
-                    for i_nl in range(num_leads):
-                        val = data.loc[(data['FCST_LEAD'] == fcst_leads[i_nl])]
-                        if not val.empty:
-                            tmp[i_nl] = val[STATS[i_ns]]
-                    
-                    l, = ax.plot(range(num_leads), tmp[:], linewidth=2)
-                    exec('ax%s_l.append([l])'%i_ns)
+                    l, = ax.plot(range(num_leads), tmp[i_ns, :, 0], linewidth=2)
+                    axs_l[i_ns].append([l])
     
             # add the line type to the legend
             line_list.append(l)
@@ -341,7 +445,7 @@ line_count = len(line_list)
 line_colors = sns.color_palette('husl', line_count)
 for i_lc in range(line_count):
     for i_ns in range(2):
-        exec('axl = ax%s_l[i_lc]'%i_ns)
+        axl = axs_l[i_ns][i_lc]
         for i_na in range(len(axl)):
             l = axl[i_na]
             l.set_color(line_colors[i_lc])
@@ -352,10 +456,6 @@ for i_lc in range(line_count):
 ##################################################################################
 # define display parameters
 
-# generate tic labels based on hour values
-for i_nl in range(num_leads):
-    fcst_leads[i_nl] = fcst_leads[i_nl][:-4]
-
 ax1.set_xticks(range(num_leads))
 ax1.set_xticklabels(fcst_leads)
 
@@ -411,7 +511,7 @@ fig.legend(line_list, line_labs, fontsize=18, ncol=ncols, loc='center',
            bbox_to_anchor=[0.5, 0.83])
 
 # save figure and display
-os.system('mkdir -p ' + OUT_DIR)
+os.makedirs(OUT_DIR, exist_ok=True)
 plt.savefig(OUT_PATH)
 #plt.show()
 
@@ -36,14 +36,11 @@ import matplotlib
 matplotlib.use('TkAgg')
 from datetime import datetime as dt
 import matplotlib.pyplot as plt
-from matplotlib.colors import Normalize as nrm
-from matplotlib.cm import get_cmap
-from matplotlib.colorbar import Colorbar as cb
 import seaborn as sns
 import numpy as np
-import pickle
-import os
 from py_plt_utilities import USR_HME
+from met_line_types import apply_dtypes, add_numeric_cols
+from gridstat_loader import load_bin
 
 ##################################################################################
 # SET GLOBAL PARAMETERS 
@@ -118,35 +115,30 @@ in_path = data_root + '/grid_stats_' + GRD + '_' + START_DT +\
 out_path = data_root + '/' + VALID_DT + '_' + LND_MSK + '_' + stat1 + '_' +\
            stat2 + '_heatplot.png'
 
-f = open(in_path, 'rb')
-data = pickle.load(f)
-f.close()
+data = load_bin(in_path)
 
 # load the values for valid time with landmask, lead and threshold
 vals = [
         'VX_MASK',
-        'FCST_LEAD',
+        'LEAD_HR',
         'FCST_THRESH',
-        'FCST_VALID_END',
+        'THRESH_VAL',
+        'VALID_DT',
        ]
 vals += STATS
 
-# cut down df to specified region and valid time, obtain levels of data 
-stat_data = data[TYPE][vals]
+# cut down df to specified region and valid time, obtain levels of data, where
+# the pickled strings are typed and parsed into numeric leads and thresholds
+stat_data = add_numeric_cols(apply_dtypes(data[TYPE], TYPE))[vals]
 stat_data = stat_data.loc[(stat_data['VX_MASK'] == LND_MSK)]
-stat_data = stat_data.loc[(stat_data['FCST_VALID_END'] ==
-                           valid_dt.strftime('%Y%m%d_%H%M%S'))]
+stat_data = stat_data.loc[(stat_data['VALID_DT'] == valid_dt)]
 
-# NOTE: sorting below is designed to handle the issue of string sorting with
-# symbols and non-left-padded decimals
+# sorts levels on decreasing threshold value
+data_levels = stat_data.drop_duplicates('FCST_THRESH').sort_values(
+        'THRESH_VAL', ascending=False)['FCST_THRESH'].tolist()
 
-# sorts first on length of integer expansion with inequalities, secondly on char
-data_levels = sorted(list(set(stat_data['FCST_THRESH'].values)),
-                     key=lambda x:(len(x.split('.')[0]), x), reverse=True)
-
-# sorts first on length of integer expansion for hours, secondly on char
-data_leads = sorted(list(set(stat_data['FCST_LEAD'].values)),
-                    key=lambda x:(len(x), x))
+# sorts leads on increasing hours
+data_leads = list(np.unique(stat_data['LEAD_HR']))
 num_levels = len(data_levels)
 num_leads = len(data_leads)
 
@@ -157,7 +149,7 @@ for k in range(2):
     for i in range(num_levels):
         for j in range(num_leads):
             val = stat_data.loc[(stat_data['FCST_THRESH'] == data_levels[i]) &
-                                 (stat_data['FCST_LEAD'] == data_leads[j])]
+                                 (stat_data['LEAD_HR'] == data_leads[j])]
             
             tmp[i, j, k] = val[STATS[k]]
 
@@ -190,10 +182,6 @@ sns.heatmap(tmp[:,:,1], linewidth=0.5, ax=ax2, cbar_ax=ax0, vmin=min_scale,
 ##################################################################################
 # define display parameters
 
-# generate tic labels based on hour values
-for i in range(num_leads):
-    data_leads[i] = data_leads[i][:2]
-
 ax0.set_yticklabels(ax0.get_yticklabels(), rotation=270, va='top')
 ax1.set_xticklabels(data_leads)
 ax1.set_yticklabels(data_levels)
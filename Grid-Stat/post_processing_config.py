@@ -87,6 +87,23 @@ PRFXS = [
         '',
         ]
 
+# read statistics for plotting with a single query of the database synced by
+# gridstat_db.py, instead of the statistics store of each cycle, True / False
+USE_DB = False
+
+# read statistics for plotting as slices of the cubes built by gridstat_cube.py,
+# taking precedence over USE_DB, True / False
+USE_CUBE = False
+
+# aggregate lineplots over the valid dates from ANL_STRT to ANL_END, every ANL_INT
+# hours, plotting the mean of each statistic by lead over the valid dates instead
+# of the statistics of VALID_DT, True / False
+AGG_VLD = False
+
+# confidence intervals of aggregated lineplots, 'BC' for bootstrap intervals
+# resampling the valid dates or 'NC' for normal intervals of the means
+AGG_CNF = 'BC'
+
 # Max forecast lead time to plot in hours
 MAX_LD = '240'
 
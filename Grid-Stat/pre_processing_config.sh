@@ -85,7 +85,8 @@ export RGRD=TRUE
 # Neighborhood width for neighborhood methods
 export NBRHD_WDTH=9
 
-# Number of bootstrap resamplings, set 0 for off
+# Number of bootstrap resamplings, set 0 for off, intervals over cycles are
+# estimated from the aggregated partial sums by gridstat_agg.py
 export BTSTRP=0
 
 # Rank correlation computation flag, TRUE or FALSE
@@ -4,8 +4,8 @@
 # This script reads in arbitrary grid_stat_* output files from a MET analysis
 # and creates Pandas dataframes containing a time series for each file type
 # versus lead time to a verification period. The dataframes are saved into a
-# Pickled dictionary organized by MET file extension as key names, taken
-# agnostically from bash wildcard patterns.
+# columnar statistics store, see gridstat_store.py, organized by MET file
+# extension as line type names, taken agnostically from bash wildcard patterns.
 #
 # Batches of hyper-parameter-dependent data can be processed by constructing
 # lists of proc_gridstat arguments which define configurations that will be mapped
@@ -34,16 +34,24 @@
 ##################################################################################
 import sys
 import os
-import numpy as np
 import pandas as pd
-import pickle
-import copy
-import glob
 from datetime import datetime as dt
-from datetime import timedelta
 import multiprocessing 
 from multiprocessing import Pool
 import post_processing_config as config
+from gridstat_paths import IN_ROOT, OUT_ROOT
+import shutil
+import hashlib
+import io
+import time
+from met_line_types import HDR_COLS, LINE_TYPES, get_dtypes, add_numeric_cols
+from gridstat_store import STORE_VRSN, write_part, compact_store,\
+                           read_schemas, replace_store, read_manifest,\
+                           write_manifest
+from proc_logging import start_listener, init_worker, get_logger
+from gridstat_index import load_index, index_glob, get_size
+from gridstat_db import DB_F, sync_db
+from gridstat_cube import CUBE_DIR, build_cubes
 
 ##################################################################################
 # SET GLOBAL PARAMETERS 
@@ -61,11 +69,39 @@ GRDS = [
         'd03',
        ]                                                           
 
-# root directory for gridstat outputs
-IN_ROOT = '/cw3e/mead/projects/cwp106/scratch/' + config.CSE
+# re-process all configurations, including those with inputs unchanged since
+# the manifest of their existing output was written
+FORCE = False
 
-# root directory for processed pandas outputs
-OUT_ROOT = '/cw3e/mead/projects/cwp106/scratch/' + config.CSE
+# Grid-Stat output format to ingest, 'txt' to parse the grid_stat_*.txt file of
+# each line type or 'stat' to parse the single combined grid_stat_*.stat file
+# per lead, split by line type
+IN_FMT = 'txt'
+
+# maximum number of rows parsed at once, each batch of rows is written as one
+# part of the store so that the memory of a worker is bounded by this size
+CHNK_SZ = 20000
+
+# number of task batches per worker dispatched to the pool, where larger values
+# balance load more finely at the cost of more dispatch overhead
+BTCH_FCTR = 4
+
+# estimated fixed cost of processing a configuration in equivalent input bytes,
+# e.g., for reading the manifest and writing the store
+TSK_OVRHD = 2**16
+
+# sync the statistics database of gridstat_db.py with the stores below OUT_ROOT
+# when all configurations are processed, True / False
+SYNC_DB = False
+
+# build the statistics cubes of gridstat_cube.py from the stores below OUT_ROOT
+# when all configurations are processed, True / False
+BUILD_CUBE = False
+
+# verbosity of the log written to OUT_ROOT/batch_logs/proc_gridstat.log, one of
+# 'DEBUG', 'INFO', 'WARNING' or 'ERROR', where 'DEBUG' also logs every file
+# opened and the columns of every line type
+LOG_LVL = 'INFO'
 
 ##################################################################################
 # Construct hyper-paramter array for batch processing gridstat data
@@ -144,8 +180,230 @@ if __name__ == '__main__':
 ##################################################################################
 # Data processing routines
 ##################################################################################
-#  function for multiprocessing parameter map
-def proc_gridstat(cnfg):
+# function to compute the content hash of an input file
+def hash_file(in_path):
+    sha = hashlib.sha1()
+    with open(in_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2**20), b''):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+# function to record the path, size, modification time and content hash of
+# input files, where hashes are reused from a previous manifest for files with
+# unchanged size and modification time
+def stat_inputs(in_paths, manifest=None):
+    old_recs = {}
+    if manifest is not None:
+        for rec in manifest['inputs']:
+            old_recs[rec['path']] = rec
+
+    in_recs = []
+    for in_path in in_paths:
+        f_stat = os.stat(in_path)
+        rec = {'path': in_path, 'size': f_stat.st_size,
+               'mtime': f_stat.st_mtime_ns}
+
+        if in_path in old_recs.keys() and\
+                old_recs[in_path]['size'] == rec['size'] and\
+                old_recs[in_path]['mtime'] == rec['mtime']:
+            rec['hash'] = old_recs[in_path]['hash']
+
+        else:
+            rec['hash'] = hash_file(in_path)
+
+        in_recs.append(rec)
+
+    return in_recs
+
+# function to check if the inputs recorded in a manifest are unchanged, with
+# the same paths and content hashes, where stores of an older layout version are
+# always re-processed
+def is_unchanged(manifest, in_recs):
+    if manifest is None or manifest.get('version') != STORE_VRSN:
+        return False
+
+    old_keys = [(rec['path'], rec['hash']) for rec in manifest['inputs']]
+    new_keys = [(rec['path'], rec['hash']) for rec in in_recs]
+
+    return old_keys == new_keys
+
+# generator to parse a grid_stat_*.txt file in one pass, yielding dataframes of
+# at most chunk_size rows, with column names taken from the header line, NA
+# values replaced with NaN, derived numeric columns of met_line_types.py added
+# and rows indexed by 'line' starting at 1
+def iter_gridstat_txt(in_path, line_type, chunk_size):
+    with open(in_path) as f:
+        cols = f.readline().split()
+
+        if len(cols) == 0:
+            return
+
+        # read the remaining lines as whitespace separated columns, with compact
+        # types from the line type registry, header strings are kept as
+        # categories to preserve non-padded leads and thresholds
+        reader = pd.read_csv(f, sep=r'\s+', header=None, names=cols,
+                             index_col=False,
+                             dtype=get_dtypes(line_type, cols),
+                             na_values=['NA'], keep_default_na=False,
+                             chunksize=chunk_size)
+
+        # rows are numbered by a running offset, as files with only a header
+        # line yield empty chunks
+        line_offset = 0
+        for fname_df in reader:
+            n_rows = len(fname_df.index)
+            if n_rows == 0:
+                continue
+
+            fname_df.index = pd.RangeIndex(line_offset + 1,
+                                           line_offset + n_rows + 1, name='line')
+            line_offset += n_rows
+            yield add_numeric_cols(fname_df)
+
+# function to parse lines of a grid_stat_*.stat file of a single line type,
+# where column names are taken from the line type registry, and columns beyond
+# the registered layout or of unregistered line types are named by position as
+# COL_N, derived numeric columns of met_line_types.py are added and rows are
+# indexed by 'line' starting at line_indx
+def parse_stat_lines(lines, line_type, hdr, line_indx):
+    if line_type in LINE_TYPES.keys():
+        cols = HDR_COLS + LINE_TYPES[line_type]
+
+    else:
+        cols = list(hdr)
+
+    # the number of columns may vary by line type and version of MET
+    num_cols = max([len(line.split()) for line in lines])
+    for i_nc in range(len(cols), num_cols):
+        cols.append('COL_' + str(i_nc))
+
+    dtypes = get_dtypes(line_type, cols)
+    if dtypes is not str:
+        for col in cols[len(HDR_COLS) + len(LINE_TYPES[line_type]):]:
+            dtypes[col] = str
+
+    fname_df = pd.read_csv(io.StringIO(''.join(lines)), sep=r'\s+',
+                           header=None, names=cols, index_col=False,
+                           dtype=dtypes, na_values=['NA'],
+                           keep_default_na=False)
+
+    fname_df.index = pd.RangeIndex(line_indx, line_indx + len(fname_df.index),
+                                   name='line')
+
+    return add_numeric_cols(fname_df)
+
+# generator to parse a grid_stat_*.stat file in one pass, streaming rows into
+# buffers by LINE_TYPE and yielding the lower case line type, as in the file
+# extensions of the grid_stat_*.txt outputs, with a dataframe of at most
+# chunk_size rows each time a buffer is full and for the remainders at the end
+def iter_gridstat_stat(in_path, chunk_size):
+    with open(in_path) as f:
+        hdr = f.readline().split()
+        if len(hdr) == 0:
+            return
+
+        i_lt = hdr.index('LINE_TYPE')
+        hdr = hdr[:i_lt + 1]
+        lines = {}
+        line_indx = {}
+        for line in f:
+            split_line = line.split(None, i_lt + 1)
+            if len(split_line) > i_lt:
+                line_type = split_line[i_lt].lower()
+                if line_type not in lines.keys():
+                    lines[line_type] = []
+                    line_indx[line_type] = 1
+
+                lines[line_type].append(line)
+                if len(lines[line_type]) == chunk_size:
+                    yield line_type, parse_stat_lines(lines[line_type],
+                            line_type, hdr, line_indx[line_type])
+
+                    line_indx[line_type] += chunk_size
+                    lines[line_type] = []
+
+    for line_type in lines.keys():
+        if len(lines[line_type]) > 0:
+            yield line_type, parse_stat_lines(lines[line_type], line_type,
+                                              hdr, line_indx[line_type])
+
+# function to define the wildcard pattern for the gridstat files of a
+# configuration based on the analysis date
+def get_in_pattern(cnfg):
+    anl_strng, ctr_flw, prfx, grid, in_cyc_dir, in_dt_subdir, out_cyc_dir = cnfg
+
+    # include underscore if prefix is of nonzero length
+    if len(prfx) > 0:
+        pfx = '_' + prfx
+    else:
+        pfx = ''
+
+    return IN_ROOT + in_cyc_dir + '/' + anl_strng + in_dt_subdir +\
+           '/grid_stat' + pfx + '*.' + IN_FMT
+
+# function to find the sorted gridstat files of a configuration in the index of
+# IN_ROOT, sorting compares first on the length of lead time for non left-padded
+# values, where the lead time is the fourth / third to last component of the
+# file name of the *.txt / *.stat outputs
+def get_in_paths(cnfg, index):
+    if IN_FMT == 'stat':
+        ld_indx = -3
+
+    else:
+        ld_indx = -4
+
+    return sorted(index_glob(index, get_in_pattern(cnfg)),
+                  key=lambda x:(len(x.split('_')[ld_indx]), x))
+
+# function to estimate the cost of processing a configuration from the byte
+# count of its inputs recorded in the index
+def get_cost(in_paths, index):
+    cost = TSK_OVRHD
+    for in_path in in_paths:
+        cost += get_size(index, in_path)
+
+    return cost
+
+# function to group tasks into batches for dispatch, ordered longest first,
+# where tasks are taken by decreasing cost and added to a batch until it reaches
+# the mean cost of n_btchs batches, so that costly configurations are dispatched
+# alone and early while inexpensive ones are grouped to limit dispatch overhead
+def get_batches(tasks, costs, n_btchs):
+    order = sorted(range(len(tasks)), key=lambda i_nc: costs[i_nc],
+                   reverse=True)
+    trgt_cost = sum(costs) / max(n_btchs, 1)
+
+    batches = []
+    batch = []
+    btch_cost = 0
+    for i_nc in order:
+        batch.append(tasks[i_nc])
+        btch_cost += costs[i_nc]
+        if btch_cost >= trgt_cost:
+            batches.append(batch)
+            batch = []
+            btch_cost = 0
+
+    if len(batch) > 0:
+        batches.append(batch)
+
+    return batches
+
+# function for multiprocessing batch map of configurations and their inputs,
+# returns the configuration, wall time and worker process id of each task
+def proc_batch(batch):
+    task_times = []
+    for cnfg, in_paths in batch:
+        strt = time.perf_counter()
+        proc_gridstat(cnfg, in_paths)
+        task_times.append([cnfg, time.perf_counter() - strt, os.getpid()])
+
+    return task_times
+
+#  function for multiprocessing parameter map, where in_paths are the sorted
+#  inputs of the configuration resolved from the index
+def proc_gridstat(cnfg, in_paths):
     # unpack argument list
     anl_strng, ctr_flw, prfx, grid, in_cyc_dir, in_dt_subdir, out_cyc_dir = cnfg
 
@@ -161,122 +419,113 @@ def proc_gridstat(cnfg):
     else:
         grd = ''
 
-    log_dir = OUT_ROOT + '/batch_logs'
-    os.system('mkdir -p ' + log_dir)
-
-    with open(log_dir + '/proc_gridstat' + pfx + grd + '_' + ctr_flw + '_' +\
-              anl_strng + '.log', 'w') as log_f:
+    # log records are tagged with the configuration and sent to the listener
+    log = get_logger('proc_gridstat', anl_strng + pfx + grd + '_' + ctr_flw)
 
-        # define derived data paths 
-        in_data_root = IN_ROOT + in_cyc_dir 
+    # define derived data paths 
+    in_data_root = IN_ROOT + in_cyc_dir 
 
-        out_data_root = OUT_ROOT + out_cyc_dir
-        os.system('mkdir -p ' + out_data_root)
-        
-        # check for input / output root directory
-        if not os.path.isdir(in_data_root):
-            print('ERROR: input data root directory ' + in_data_root +\
-                    ' does not exist.', file=log_f)
-            sys.exit(1)
-        
-        # check for input / output root directory
-        elif not os.path.isdir(out_data_root):
-            print('ERROR: output data root directory ' + out_data_root +\
-                    ' does not exist.', file=log_f)
-            sys.exit(1)
-        
-        # initiate empty dictionary for storage of dataframes by keyname
-        data_dict = {}
+    out_data_root = OUT_ROOT + out_cyc_dir
+    os.makedirs(out_data_root, exist_ok=True)
     
-        # define the gridstat files to open based on the analysis date
-        in_paths = in_data_root + '/' + anl_strng + in_dt_subdir  +\
-                   '/grid_stat' + pfx + '*.txt'
-
-        print('Loading grid_stat ASCII outputs from in_paths:', file=log_f)
-        print(STR_INDT + in_paths, file=log_f)
+    # check for input / output root directory
+    if not os.path.isdir(in_data_root):
+        log.error('input data root directory ' + in_data_root +\
+                ' does not exist.')
+        sys.exit(1)
     
-        # define the output binary file for pickled dataframe per date
-        out_dir = out_data_root + '/' + anl_strng
-        out_path = out_dir + '/grid_stats' + pfx + grd + '_' + anl_strng + '.bin'
-        os.system('mkdir -p ' + out_dir)
-
-        print('Writing Pandas dataframe pickled binary files to out_path:',
-                file=log_f)
-        print(STR_INDT + out_path, file=log_f)
-
-        # loop sorted grid_stat_pfx* files, sorting compares first on the
-        # length of lead time for non left-padded values
-        in_paths = sorted(glob.glob(in_paths),
-                          key=lambda x:(len(x.split('_')[-4]), x))
-        for in_path in in_paths:
-            print('Opening file ' + in_path, file=log_f)
+    # check for input / output root directory
+    elif not os.path.isdir(out_data_root):
+        log.error('output data root directory ' + out_data_root +\
+                ' does not exist.')
+        sys.exit(1)
     
+    # initiate empty dictionary for the number of parts written by keyname
+    num_parts = {}
+
+    # define the gridstat files to open based on the analysis date
+    log.info('Loading grid_stat ASCII outputs from in_paths ' +\
+            get_in_pattern(cnfg))
+
+    # define the output columnar store per date
+    out_dir = out_data_root + '/' + anl_strng
+    out_path = out_dir + '/grid_stats' + pfx + grd + '_' + anl_strng
+
+    # skip the configuration if the inputs are unchanged since the
+    # manifest of the existing store was written
+    manifest = read_manifest(out_path)
+    in_recs = stat_inputs(in_paths, manifest)
+    if not FORCE and is_unchanged(manifest, in_recs):
+        log.info('Inputs are unchanged since the manifest of ' + out_path +\
+                ' was written, skipping this configuration.')
+
+        # record updated modification times of unchanged inputs
+        manifest['inputs'] = in_recs
+        write_manifest(out_path, manifest)
+
+        print('Skipped: ' + anl_strng + '_' + prfx + grid + ctr_flw)
+        return
+
+    # parts are written to a temporary store that replaces any existing
+    # store when completed
+    tmp_path = out_path + '.tmp'
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+
+    os.makedirs(tmp_path)
+
+    log.info('Writing columnar statistics store to out_path ' + out_path)
+
+    for in_path in in_paths:
+        log.debug('Opening file ' + in_path)
+
+        if IN_FMT == 'stat':
+            # stream the combined file in a single pass split by line type
+            fname_dfs = iter_gridstat_stat(in_path, CHNK_SZ)
+
+        else:
             # cut the diagnostic type from file name
             fname = in_path.split('/')[-1]
             split_name = fname.split('_')
             postfix = split_name[-1].split('.')
             postfix = postfix[0]
-    
-            # open file, load column names, then loop lines
-            with open(in_path) as f:
-                cols = f.readline()
-                cols = cols.split()
-                
-                if len(cols) > 0:
-                    fname_df = {} 
-                    tmp_dict = {}
-                    df_indx = 1
-    
-                    print(STR_INDT + 'Loading columns:', file=log_f)
-                    for col_name in cols:
-                        print(STR_INDT * 2 + col_name, file=log_f)
-                        fname_df[col_name] = [] 
-    
-                    fname_df = pd.DataFrame.from_dict(fname_df,
-                                                      orient='columns')
-    
-                    # parse file by line, concatenating columns
-                    for line in f:
-                        split_line = line.split()
-    
-                        for i in range(len(split_line)):
-                            val = split_line[i]
-    
-                            # filter NA vals
-                            if val == 'NA':
-                                val = np.nan
-                            tmp_dict[cols[i]] = val
-    
-                        tmp_dict['line'] = [df_indx]
-                        tmp_dict = pd.DataFrame.from_dict(tmp_dict,
-                                                          orient='columns')
-                        fname_df = pd.concat([fname_df, tmp_dict], axis=0)
-                        df_indx += 1
-    
-                    fname_df['line'] = fname_df['line'].astype(int)
-                    
-                    if postfix in data_dict.keys():
-                        last_indx = data_dict[postfix].index[-1]
-                        fname_df['line'] = fname_df['line'].add(last_indx)
-                        fname_df = fname_df.set_index('line')
-                        data_dict[postfix] = pd.concat([data_dict[postfix],
-                                                        fname_df], axis=0)
-    
-                    else:
-                        fname_df = fname_df.set_index('line')
-                        data_dict[postfix] = fname_df
-    
-                else:
-                    print('WARNING: file ' + in_path +\
-                            ' is empty, skipping this file.', file=log_f)
-    
-                print('Closing file ' + in_path, file=log_f)
-    
-        print('Writing out data to ' + out_path, file=log_f)
-        with open(out_path, 'wb') as f:
-            pickle.dump(data_dict, f)
 
-        print('Completed: ' + anl_strng + '_' + prfx + grid + ctr_flw) 
+            # stream the file in a single pass into columns
+            fname_dfs = ((postfix, fname_df) for fname_df in
+                         iter_gridstat_txt(in_path, postfix, CHNK_SZ))
+
+        num_chnks = 0
+        for postfix, fname_df in fname_dfs:
+            if postfix not in num_parts.keys():
+                log.debug('Loading ' + postfix + ' columns: ' +\
+                        ' '.join(fname_df.columns))
+
+                num_parts[postfix] = 0
+
+            # write each batch as the next part of the keyname, line
+            # numbering continues across parts when read from the store
+            write_part(tmp_path, postfix, fname_df, num_parts[postfix])
+            num_parts[postfix] += 1
+            num_chnks += 1
+
+        if num_chnks == 0:
+            log.warning('file ' + in_path + ' is empty, skipping this file.')
+
+        log.debug('Closing file ' + in_path)
+
+    # merge the parts of each line type for memory-mapped reading
+    compact_store(tmp_path)
+    for postfix in num_parts.keys():
+        num_parts[postfix] = len(read_schemas(tmp_path, postfix))
+
+    log.info('Writing out data to ' + out_path)
+    manifest = {'version': STORE_VRSN, 'inputs': in_recs, 'output': out_path,
+                'parts': num_parts, 'ctr_flw': ctr_flw, 'grid': grid,
+                'prfx': prfx, 'cycle': anl_strng}
+    write_manifest(tmp_path, manifest)
+    replace_store(tmp_path, out_path)
+
+    print('Completed: ' + anl_strng + '_' + prfx + grid + ctr_flw) 
 
 ##################################################################################
 # Runs multiprocessing on parameter grid
@@ -284,11 +533,63 @@ def proc_gridstat(cnfg):
 # run lines if executed as a script
 if __name__ == '__main__':
     # infer available cpus for workers
-    n_workers = multiprocessing.cpu_count() - 1
-    print('Running proc_gridstat with ' + str(n_workers) + ' total workers.')
+    n_workers = max(multiprocessing.cpu_count() - 1, 1)
+
+    # resolve the inputs of all configurations from one scan of IN_ROOT
+    index = load_index(IN_ROOT)
+    tasks = [[cnfg, get_in_paths(cnfg, index)] for cnfg in CNFGS]
+
+    # estimate configuration costs from input sizes and batch longest first
+    costs = [get_cost(in_paths, index) for cnfg, in_paths in tasks]
+    batches = get_batches(tasks, costs, n_workers * BTCH_FCTR)
+    print('Running proc_gridstat with ' + str(n_workers) + ' total workers' +\
+            ' on ' + str(len(batches)) + ' batches.')
+
+    # workers send log records to a single writer of the log file
+    log_q, listener = start_listener(OUT_ROOT + '/batch_logs/proc_gridstat.log',
+                                     LOG_LVL)
+
+    strt = time.perf_counter()
+    task_times = []
+    with Pool(n_workers, initializer=init_worker,
+              initargs=(log_q, LOG_LVL)) as pool:
+        for btch_times in pool.imap_unordered(proc_batch, batches):
+            task_times += btch_times
+
+    wall_time = time.perf_counter() - strt
+    listener.stop()
+
+    # report task wall times in decreasing order and worker utilization
+    print('Task wall times:')
+    task_times = sorted(task_times, key=lambda x: x[1], reverse=True)
+    busy_times = {}
+    for cnfg, task_time, pid in task_times:
+        print(STR_INDT + cnfg[0] + ' ' + cnfg[2] + ' ' + cnfg[1] + ' ' +\
+                cnfg[3] + ' ' + '%.2f'%task_time + 's')
+
+        if pid not in busy_times.keys():
+            busy_times[pid] = 0.0
+
+        busy_times[pid] += task_time
+
+    print('Worker busy times:')
+    for pid in sorted(busy_times.keys()):
+        print(STR_INDT + str(pid) + ' ' + '%.2f'%busy_times[pid] + 's')
+
+    print('Total wall time ' + '%.2f'%wall_time + 's, worker utilization ' +\
+            '%.1f'%(100 * sum(busy_times.values()) /\
+                    max(n_workers * wall_time, 1e-9)) + '%')
+
+    if SYNC_DB:
+        print('Syncing statistics database ' + OUT_ROOT + '/' + DB_F)
+        num_load, num_drop = sync_db(OUT_ROOT)
+        print(STR_INDT + 'Loaded ' + str(num_load) + ' stores, dropped ' +\
+                str(num_drop) + ' stores.')
 
-    with Pool(n_workers) as pool:
-        print(*pool.map(proc_gridstat, CNFGS))
+    if BUILD_CUBE:
+        print('Building statistics cubes ' + OUT_ROOT + '/' + CUBE_DIR)
+        built = build_cubes(OUT_ROOT)
+        print(STR_INDT + 'Built cubes of line types ' + str(built) + '.')
 
 ##################################################################################
 # end
@@ -0,0 +1,77 @@
+##################################################################################
+# Description
+##################################################################################
+# This module defines the centralized logging of the post-processing scripts
+# run with Python multiprocessing. Workers do not open log files themselves,
+# but send log records through a queue to a single listener in the parent
+# process, which writes all records to one log file. Records are tagged with
+# the configuration being processed and the name of the worker process, and
+# the verbosity of the log is set by a standard logging level name.
+#
+##################################################################################
+# License Statement
+##################################################################################
+#
+# Copyright 2023 CW3E, Contact Colin Grudzien cgrudzien@ucsd.edu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+#
+##################################################################################
+# Imports
+##################################################################################
+import os
+import logging
+import logging.handlers
+import multiprocessing
+
+##################################################################################
+# SET GLOBAL PARAMETERS
+##################################################################################
+# format of log records, where cnfg is the configuration being processed
+LOG_FMT = '%(asctime)s %(processName)s %(levelname)s [%(cnfg)s] %(message)s'
+
+##################################################################################
+# Logging routines
+##################################################################################
+# function to start the single writer of the log file at log_path, returns the
+# queue that workers send records to and the listener to be stopped when done
+def start_listener(log_path, log_lvl='INFO'):
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+
+    handler = logging.FileHandler(log_path, mode='w')
+    handler.setFormatter(logging.Formatter(LOG_FMT, defaults={'cnfg': ''}))
+    handler.setLevel(log_lvl)
+
+    log_q = multiprocessing.Queue()
+    listener = logging.handlers.QueueListener(log_q, handler,
+                                              respect_handler_level=True)
+    listener.start()
+
+    return log_q, listener
+
+# function to direct all log records of the current process to the queue of
+# the listener, used as the initializer of worker pools
+def init_worker(log_q, log_lvl='INFO'):
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+
+    root.addHandler(logging.handlers.QueueHandler(log_q))
+    root.setLevel(log_lvl)
+
+# function to obtain a logger that tags its records with a configuration label
+def get_logger(name, cnfg=''):
+    return logging.LoggerAdapter(logging.getLogger(name), {'cnfg': cnfg})
+
+##################################################################################
+# end
@@ -0,0 +1,261 @@
+##################################################################################
+# Description
+##################################################################################
+# This script runs a local plotting service, which renders the figures of the
+# plotting scripts of this directory on request over HTTP on localhost, e.g.,
+# for the interactive review of figures during the NRT season. The service is a
+# long running process, where the plotting libraries are imported, the index of
+# the statistics stores is loaded and the plotting scripts are compiled once,
+# and the statistics read for a figure are kept in the cache of
+# gridstat_loader.py, so that figures of statistics that have been read before
+# are rendered without any imports or reads. Figures are requested as
+#
+#     http://localhost:PORT/plot?product=PRDCT&NAME=VALUE&...
+#
+# where PRDCT is a key of PRDCTS and NAME is one of PLOT_PARAMS, the settings of
+# post_processing_config selecting the plotted data, e.g., CTR_FLW, GRD,
+# LND_MSK, ANL_STRT or VALID_DT, and the global parameters of the plotting
+# scripts, e.g., STAT, as in the product matrix of batch_plot_gridstat.py.
+# Settings that are lists in post_processing_config, and the global STATS of the
+# lineplot scripts, are given as comma separated values. All other settings are
+# read from post_processing_config.py, and figures are written below the figure
+# case directory SRVC_CSE, where values with '/' or '..' are rejected so that
+# requests cannot read or write outside of OUT_ROOT. The response is the
+# rendered figure as a PNG image, and
+#
+#     http://localhost:PORT/status
+#
+# returns the products and the use of the cache as JSON. Requests are rendered
+# one at a time, as the state of pyplot is shared, and the cache is emptied when
+# the index of the stores shows re-processed stores, checked at most every
+# RFRSH_INT seconds.
+#
+##################################################################################
+# License Statement
+##################################################################################
+#
+# Copyright 2023 CW3E, Contact Colin Grudzien cgrudzien@ucsd.edu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+#
+##################################################################################
+# Imports
+##################################################################################
+import json
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+import post_processing_config as config
+from gridstat_paths import OUT_ROOT
+from batch_plot_gridstat import render_product
+from gridstat_loader import CACHE_STATS, get_cached, get_index, clear_cache
+from gridstat_index import load_index
+
+##################################################################################
+# SET GLOBAL PARAMETERS
+##################################################################################
+# host name and port of the service, where the service is only reachable from
+# this machine on localhost
+HOST = '127.0.0.1'
+PORT = 8765
+
+# plotting scripts of the products that can be requested
+PRDCTS = {
+          'heatplot': 'plt_gridstat_multidate_heatplot.py',
+          'heatplot_level': 'plt_gridstat_multidate_heatplot_level.py',
+          'lineplot': 'plt_gridstat_multilead_lineplot.py',
+          'lineplot_level': 'plt_gridstat_multilead_lineplot_level.py',
+         }
+
+# settings of post_processing_config and global parameters of the plotting
+# scripts that can be set in a request
+PLOT_PARAMS = [
+               'CTR_FLW',
+               'CTR_FLWS',
+               'LAB_IDX',
+               'GRD',
+               'GRDS',
+               'GRD_LAB',
+               'PRFX',
+               'PRFXS',
+               'STRT_DT',
+               'END_DT',
+               'CYC_INT',
+               'ANL_STRT',
+               'ANL_END',
+               'ANL_INT',
+               'VALID_DT',
+               'MAX_LD',
+               'LND_MSK',
+               'LEV',
+               'AGG_VLD',
+               'AGG_CNF',
+               'DYN_SCL',
+               'MIN_SCALE',
+               'MAX_SCALE',
+               'TYPE',
+               'STAT',
+               'STATS',
+              ]
+
+# global parameters of the plotting scripts that are lists
+LIST_PARAMS = ['STATS']
+
+# figure case directory of the rendered figures, as FIG_CSE, so that the
+# figures of the service do not replace other figures
+SRVC_CSE = '/plot_service'
+
+# seconds between checks of the index of the stores for re-processed stores
+RFRSH_INT = 60
+
+##################################################################################
+# Service routines
+##################################################################################
+# time of the last check of the index of the stores
+RFRSH = {'time': 0.0}
+
+# function to convert the values of a request to the types of the settings of
+# post_processing_config, or to lists for the list globals of the scripts,
+# returns a dictionary of the parameters of the product, raises a ValueError for
+# parameters that are not PLOT_PARAMS and values with path separators
+def parse_params(params):
+    prdct = {}
+    for key, vals in params.items():
+        if key not in PLOT_PARAMS:
+            raise ValueError(key + ' is not a plot parameter, set one of ' +\
+                    ', '.join(PLOT_PARAMS))
+
+        val = vals[-1]
+        if '/' in val or '..' in val:
+            raise ValueError('the value of ' + key + " contains '/' or '..'")
+
+        dflt = getattr(config, key, None)
+        if isinstance(dflt, list) or key in LIST_PARAMS:
+            val = val.split(',')
+            if dflt and all(isinstance(item, int) for item in dflt):
+                val = [int(item) for item in val]
+
+        elif isinstance(dflt, bool):
+            if val not in ['True', 'False']:
+                raise ValueError(key + ' must be True or False')
+
+            val = val == 'True'
+
+        elif isinstance(dflt, (int, float)):
+            val = type(dflt)(val)
+
+        prdct[key] = val
+
+    prdct['FIG_CSE'] = SRVC_CSE
+
+    return prdct
+
+# function to list the modification times of the directories of an index with
+# statistics stores, which change when a store is added, removed or replaced by
+# a re-processed store, but not when figures are written below the root
+def get_stamps(index):
+    return {rel_dir: dir_rec['mtime'] for rel_dir, dir_rec in
+            index['dirs'].items() if len(dir_rec['stores']) > 0}
+
+# function to empty the cache of statistics if any store has been added,
+# removed or re-processed since the index of the stores was cached, checked at
+# most every RFRSH_INT seconds
+def refresh_cache():
+    if time.time() - RFRSH['time'] < RFRSH_INT:
+        return
+
+    RFRSH['time'] = time.time()
+    index = get_cached(('index', OUT_ROOT))
+    if index is not None and\
+            get_stamps(load_index(OUT_ROOT)) != get_stamps(index):
+        print('Stores below ' + OUT_ROOT + ' have changed, emptying the cache.')
+        clear_cache()
+
+# handler of the requests to the service
+class PlotHandler(BaseHTTPRequestHandler):
+    # function to send a response with a body of the content type
+    def send_body(self, code, body, ctype='text/plain'):
+        if isinstance(body, str):
+            body = body.encode()
+
+        self.send_response(code)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = parse_qs(url.query, keep_blank_values=True)
+        if url.path == '/status':
+            self.send_body(200, json.dumps({'products': PRDCTS,
+                                            'cache': CACHE_STATS}),
+                           'application/json')
+            return
+
+        if url.path != '/plot':
+            self.send_body(404, 'Unknown path ' + url.path + ', request /plot' +\
+                    ' or /status.\n')
+            return
+
+        prdct = params.pop('product', [''])[-1]
+        if prdct not in PRDCTS.keys():
+            self.send_body(404, 'Unknown product ' + prdct + ', request one of ' +\
+                    ', '.join(PRDCTS.keys()) + '.\n')
+            return
+
+        try:
+            prdct_params = parse_params(params)
+
+        except ValueError as err:
+            self.send_body(400, 'Invalid parameters: ' + str(err) + '.\n')
+            return
+
+        strt = time.perf_counter()
+        refresh_cache()
+        out_path = render_product(PRDCTS[prdct], prdct_params)
+        if out_path is None:
+            self.send_body(500, 'Product ' + prdct + ' was not rendered, see ' +\
+                    'the output of the service for warnings.\n')
+            return
+
+        with open(out_path, 'rb') as f:
+            self.send_body(200, f.read(), 'image/png')
+
+        print('Rendered ' + out_path + ' in ' +\
+                '%.2f'%(time.perf_counter() - strt) + 's')
+
+##################################################################################
+# Runs the service until interrupted
+##################################################################################
+# run lines if executed as a script
+if __name__ == '__main__':
+    # load the index of the stores before the first request
+    get_index(OUT_ROOT)
+    RFRSH['time'] = time.time()
+
+    # requests are handled one at a time by a single threaded server
+    server = HTTPServer((HOST, PORT), PlotHandler)
+    print('Serving figures of ' + OUT_ROOT + ' at http://' + HOST + ':' +\
+            str(PORT) + '/plot')
+
+    try:
+        server.serve_forever()
+
+    except KeyboardInterrupt:
+        pass
+
+    server.server_close()
+
+##################################################################################
+# end
@@ -0,0 +1,56 @@
+##################################################################################
+# Description
+##################################################################################
+# This module tests the parsing of grid_stat_*.txt files by proc_gridstat.py,
+# run with
+#
+#     python -m pytest test_proc_gridstat.py
+#
+# from this directory.
+#
+##################################################################################
+# License Statement
+##################################################################################
+#
+# Copyright 2023 CW3E, Contact Colin Grudzien cgrudzien@ucsd.edu
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+#
+##################################################################################
+# Imports
+##################################################################################
+from proc_gridstat import iter_gridstat_txt
+from met_line_types import HDR_COLS, LINE_TYPES
+
+##################################################################################
+# Tests
+##################################################################################
+# header line of a grid_stat_*_cnt.txt file
+CNT_HDR = ' '.join(HDR_COLS + LINE_TYPES['cnt']) + '\n'
+
+# a file with only a header line yields no dataframes
+def test_header_only(tmp_path):
+    in_path = tmp_path / 'grid_stat_240000L_20221216_000000V_cnt.txt'
+    in_path.write_text(CNT_HDR)
+
+    assert list(iter_gridstat_txt(str(in_path), 'cnt', 5)) == []
+
+# an empty file yields no dataframes
+def test_empty(tmp_path):
+    in_path = tmp_path / 'grid_stat_240000L_20221216_000000V_cnt.txt'
+    in_path.write_text('')
+
+    assert list(iter_gridstat_txt(str(in_path), 'cnt', 5)) == []
+
+##################################################################################
+# end